@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from downloader import Manifest, RetryPolicy, download_all
+
+# Runs the downloader against mock-tally-server.py with several configurations and
+# reports images/s, MB/s, p50/p99 latency and retry counts for each of them.
+
+DEFAULT_CONFIGS = [
+    'rate=10,connections=5,per_host=5',
+    'rate=50,connections=16,per_host=8',
+    'rate=100,connections=32,per_host=16',
+    'rate=0,connections=64,per_host=32',
+]
+
+def parse_config(text):
+    config = {'rate': 20, 'connections': 16, 'per_host': 8, 'window': 256}
+    for item in text.split(','):
+        key, value = item.split('=')
+        config[key.strip()] = float(value) if key.strip() == 'rate' else int(value)
+    return config
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+async def server_stats(base_url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'{base_url}/stats') as response:
+            return await response.json()
+
+async def wait_for_server(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await server_stats(base_url)
+        except aiohttp.ClientError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+async def run_config(base_url, config, count):
+    results = []
+
+    async def collect(result):
+        results.append(result)
+
+    with tempfile.TemporaryDirectory() as image_dir:
+        manifest = Manifest(os.path.join(image_dir, 'manifest.sqlite'))
+        jobs = ((f'{base_url}/actas/{i:06d}.jpg', os.path.join(image_dir, f'{i:06d}.jpg')) for i in range(count))
+        before = await server_stats(base_url)
+        start = time.perf_counter()
+        await download_all(jobs, manifest, rate=config['rate'], max_connections=config['connections'],
+                           per_host=config['per_host'], window=config['window'],
+                           policy=RetryPolicy(base_delay=0.1), on_result=collect, verbose=False)
+        wall = time.perf_counter() - start
+        after = await server_stats(base_url)
+        manifest.close()
+
+    completed = [r for r in results if r['status'] != 'failed']
+    latencies = [r['elapsed'] * 1000 for r in completed]
+    return {
+        'images_per_s': len(completed) / wall,
+        'mb_per_s': sum(r['bytes'] for r in results) / wall / 1e6,
+        'p50_ms': statistics.median(latencies) if latencies else 0.0,
+        'p99_ms': percentile(latencies, 99),
+        'retries': sum(r['retries'] for r in results),
+        'failed': len(results) - len(completed),
+        'throttled': after['throttled'] - before['throttled'],
+        'server_errors': after['errors'] - before['errors'],
+        'wall_s': wall,
+    }
+
+async def main(args):
+    base_url = f'http://127.0.0.1:{args.port}'
+    await wait_for_server(base_url)
+    print(f"{'configuration':<40} {'img/s':>8} {'MB/s':>7} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'retries':>8} {'429s':>6} {'5xx':>5} {'failed':>7}")
+    for text in args.config or DEFAULT_CONFIGS:
+        report = await run_config(base_url, parse_config(text), args.count)
+        print(f"{text:<40} {report['images_per_s']:>8.1f} {report['mb_per_s']:>7.2f} "
+              f"{report['p50_ms']:>8.1f} {report['p99_ms']:>8.1f} {report['retries']:>8} "
+              f"{report['throttled']:>6} {report['server_errors']:>5} {report['failed']:>7}")
+
+parser = argparse.ArgumentParser(description="Benchmark downloader configurations against the mock tally server.")
+parser.add_argument('--count', type=int, default=500, help="Images downloaded per configuration")
+parser.add_argument('--config', action='append',
+                    help="Downloader settings, e.g. rate=50,connections=16,per_host=8,window=256 (repeatable)")
+parser.add_argument('--port', type=int, default=8765)
+parser.add_argument('--latency', type=float, default=50, help="Mock server mean latency in ms")
+parser.add_argument('--bandwidth', type=float, default=0, help="Mock server per-response bandwidth in KB/s")
+parser.add_argument('--error-rate', type=float, default=0.02, help="Mock server fraction of 5xx responses")
+parser.add_argument('--rate-limit', type=float, default=100, help="Mock server requests per second before 429")
+args = parser.parse_args()
+
+server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock-tally-server.py')
+server = subprocess.Popen([sys.executable, server_script, '--port', str(args.port),
+                           '--latency', str(args.latency), '--bandwidth', str(args.bandwidth),
+                           '--error-rate', str(args.error_rate), '--rate-limit', str(args.rate_limit)])
+try:
+    asyncio.run(main(args))
+finally:
+    server.terminate()
+    server.wait()
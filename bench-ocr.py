@@ -0,0 +1,136 @@
+import argparse
+import csv
+import itertools
+import os
+import random
+import time
+from functools import partial
+from multiprocessing import Pool
+
+from timestamp_ocr import (DEFAULT_PREPROCESS, INITIAL_CROP_BOX, check_backend, configure_ocr, empty_result,
+                           extract_filename, limit_engine_threads, ocr_file, parse_box, unreadable_image)
+
+# Replays the OCR on a sample of hand-validated rows and reports exact-match accuracy, NF
+# rate and images/s for each configuration. With --tune it grid-searches the options and
+# picks the fastest configuration that still meets an accuracy floor.
+
+DEFAULT_CONFIGS = [
+    'psm=3',
+    'psm=6',
+    'psm=7,whitelist=0123456789:',
+    'psm=6,whitelist=0123456789:,preprocess=gray+upscale+threshold',
+]
+
+# Options searched by --tune; values are separated by |, an empty value keeps the default
+# and "none" turns the option off
+DEFAULT_GRID = ('psm=3|6|7|11,whitelist=none|0123456789:,'
+                'preprocess=none|gray+upscale+threshold|gray+upscale+threshold+denoise+deskew')
+
+def parse_config(text):
+    """configure_ocr() arguments and initial box of a "key=value,..." benchmark config."""
+    config = {'backend': 'pytesseract', 'psm': None, 'whitelist': None, 'preprocess': '+'.join(DEFAULT_PREPROCESS),
+              'box': ':'.join(map(str, INITIAL_CROP_BOX))}
+    for item in filter(None, text.split(',')):
+        key, value = item.split('=')
+        config[key.strip()] = '' if value.strip() == 'none' else value.strip()
+    options = []
+    if config['psm']:
+        options.append(f"--psm {config['psm']}")
+    if config['whitelist']:
+        options.append(f"-c tessedit_char_whitelist={config['whitelist']}")
+    settings = {'backend': config['backend'], 'config': ' '.join(options),
+                'preprocess': tuple(filter(None, config['preprocess'].split('+')))}
+    return settings, parse_box(config['box'])
+
+def expand_grid(text):
+    axes = [(key, values.split('|')) for key, values in (item.split('=') for item in text.split(','))]
+    for values in itertools.product(*(values for _, values in axes)):
+        yield ','.join(f"{key}={value}" for (key, _), value in zip(axes, values) if value)
+
+def load_sample(truth_csv, image_dir, size, seed):
+    with open(truth_csv, 'r', newline='', encoding='utf-8') as truth_file:
+        rows = [row for row in csv.DictReader(truth_file) if row['timestamp'] != "NF"]
+    rows = [row for row in rows if os.path.exists(os.path.join(image_dir, extract_filename(row['URL'])))]
+    random.Random(seed).shuffle(rows)
+    return [(os.path.join(image_dir, extract_filename(row['URL'])), row['timestamp']) for row in rows[:size]]
+
+def ocr_task(initial_box, image_path):
+    # Only unreadable files count as NF; engine and config errors fail the run instead of
+    # ranking a broken configuration as merely inaccurate
+    try:
+        return ocr_file(image_path, initial_box)
+    except OSError as e:
+        if not unreadable_image(e):
+            raise
+        return empty_result()
+
+def run_config(text, sample, workers):
+    settings, initial_box = parse_config(text)
+    # No OCR cache and no learned layouts, so every configuration starts cold
+    init_ocr = partial(configure_ocr, ocr_cache_path=None, layout_cache_path=None, glyph_bank_path=None, **settings)
+    image_paths = [image_path for image_path, _ in sample]
+    with Pool(workers, initializer=init_ocr) as pool:
+        start = time.perf_counter()
+        results = pool.map(partial(ocr_task, initial_box), image_paths, chunksize=4)
+        wall = time.perf_counter() - start
+    correct = sum(result['timestamp'] == truth for result, (_, truth) in zip(results, sample))
+    not_found = sum(result['timestamp'] == "NF" for result in results)
+    return {
+        'accuracy': correct / len(sample),
+        'nf_rate': not_found / len(sample),
+        'wrong': len(sample) - correct - not_found,
+        'images_per_s': len(sample) / wall,
+        'ocr_calls': sum(result['ocr_calls'] for result in results) / len(sample),
+    }
+
+def print_report(text, report):
+    print(f"{text:<70} {report['accuracy']:>8.1%} {report['nf_rate']:>6.1%} {report['wrong']:>6} "
+          f"{report['images_per_s']:>8.1f} {report['ocr_calls']:>6.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark OCR configurations against validated timestamps.")
+    parser.add_argument('--truth', default="data/resultados-with-timestamps.csv",
+                        help="CSV file with hand-validated URL and timestamp columns")
+    parser.add_argument('--image-dir', default="downloaded_images")
+    parser.add_argument('--sample', type=int, default=300, help="Validated images replayed per configuration")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random sample")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="OCR processes per configuration")
+    parser.add_argument('--config', action='append',
+                        help="OCR settings, e.g. psm=7,whitelist=0123456789:,preprocess=gray+threshold,"
+                             "box=300:400:650:600,backend=tesserocr (repeatable)")
+    parser.add_argument('--tune', nargs='?', const=DEFAULT_GRID,
+                        help="Grid-search these options (default: psm, whitelist and preprocess) instead of --config")
+    parser.add_argument('--min-accuracy', type=float, default=0.98,
+                        help="Accuracy floor a tuned configuration must meet")
+    args = parser.parse_args()
+
+    sample = load_sample(args.truth, args.image_dir, args.sample, args.seed)
+    if not sample:
+        raise SystemExit(f"No validated rows of {args.truth} have an image in {args.image_dir}")
+    configs = list(expand_grid(args.tune)) if args.tune else args.config or DEFAULT_CONFIGS
+    if args.workers > 1:
+        limit_engine_threads()
+    for settings, _ in map(parse_config, configs):
+        try:
+            check_backend(settings['backend'], settings['config'])
+        except (RuntimeError, OSError) as e:
+            raise SystemExit(f"Cannot start the {settings['backend']} OCR engine: {e}")
+    print(f"{len(sample)} validated images, {len(configs)} configurations")
+    print(f"{'configuration':<70} {'accuracy':>8} {'NF':>6} {'wrong':>6} {'img/s':>8} {'calls':>6}")
+    reports = {}
+    for text in configs:
+        reports[text] = run_config(text, sample, args.workers)
+        print_report(text, reports[text])
+
+    if args.tune:
+        eligible = [text for text in configs if reports[text]['accuracy'] >= args.min_accuracy]
+        if not eligible:
+            best = max(configs, key=lambda text: reports[text]['accuracy'])
+            print(f"No configuration reaches {args.min_accuracy:.0%}; the most accurate one is {best}")
+        else:
+            best = max(eligible, key=lambda text: reports[text]['images_per_s'])
+            settings, initial_box = parse_config(best)
+            print(f"Fastest configuration with at least {args.min_accuracy:.0%} accuracy: {best}")
+            print(f"  python ocr-time.py --backend {settings['backend']} --tesseract-config \"{settings['config']}\" "
+                  f"--preprocess \"{','.join(settings['preprocess'])}\" "
+                  f"--initial-box {':'.join(map(str, initial_box))}")
@@ -0,0 +1,77 @@
+import argparse
+import csv
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from digit_templates import GLYPH_SIZE, GlyphBank, segment_lines
+from timestamp_ocr import INITIAL_CROP_BOX, Scan, configure_ocr, crop, extract_filename, rotate
+
+# Builds the glyph bank used by the template recognizer (ocr-time.py --glyph-bank) from
+# rows of resultados-with-timestamps.csv whose timestamps were already validated: the
+# line of the crop with as many glyphs as the timestamp has characters is cut into
+# glyphs and each one is labelled with its character.
+
+def glyph_width(glyph):
+    return np.count_nonzero(glyph.reshape(GLYPH_SIZE, GLYPH_SIZE).any(axis=0))
+
+def label_glyphs(image, timestamp):
+    """(glyph, character) pairs of the one line of `image` that spells `timestamp`, or []."""
+    colons = [i for i, character in enumerate(timestamp) if character == ':']
+    for glyphs in segment_lines(image):
+        if len(glyphs) != len(timestamp):
+            continue
+        widths = [glyph_width(glyph) for glyph in glyphs]
+        digits = [width for i, width in enumerate(widths) if i not in colons]
+        # Colons are the narrowest glyphs of the font, which rules out most lines of other text
+        if max(widths[i] for i in colons) < min(digits):
+            return list(zip(glyphs, timestamp))
+    return []
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the digit glyph bank from validated timestamps.")
+    parser.add_argument('--csv', default="resultados-with-timestamps.csv", help="CSV file with URL and timestamp")
+    parser.add_argument('--image-dir', default="downloaded_images")
+    parser.add_argument('--layout-cache', default="layout_cache.json",
+                        help="Learned crop boxes and orientation profiles, as written by ocr-time.py")
+    parser.add_argument('--min-confidence', type=float, default=0,
+                        help="Only use rows whose confidence column is at least this (0 = every timestamp)")
+    parser.add_argument('--per-glyph', type=int, default=40, help="Examples kept for every character")
+    parser.add_argument('--output', default="glyph_bank.npz")
+    args = parser.parse_args()
+
+    configure_ocr(layout_cache_path=args.layout_cache, ocr_cache_path=None)
+    examples = defaultdict(list)
+    used = 0
+    with open(args.csv, 'r', newline='', encoding='utf-8') as input_file:
+        for row in csv.DictReader(input_file):
+            timestamp = row['timestamp']
+            if timestamp == "NF" or float(row.get('confidence') or 100) < args.min_confidence:
+                continue
+            # Characters that already have enough examples do not need this image
+            if all(len(examples[character]) >= args.per_glyph for character in timestamp):
+                continue
+            image_path = os.path.join(args.image_dir, extract_filename(row['URL']))
+            if not os.path.exists(image_path):
+                continue
+            scan = Scan(image_path)
+            for _, angle, box, _ in scan.tight_strategies(INITIAL_CROP_BOX)[0]:
+                labelled = label_glyphs(crop(rotate(scan.rows(box[3]), angle), box), timestamp)
+                if labelled:
+                    used += 1
+                    for glyph, character in labelled:
+                        if len(examples[character]) < args.per_glyph:
+                            examples[character].append(glyph)
+                    break
+            if len(examples) == 11 and all(len(glyphs) >= args.per_glyph for glyphs in examples.values()):
+                break
+
+    labels = [character for character in sorted(examples) for _ in examples[character]]
+    glyphs = [glyph for character in sorted(examples) for glyph in examples[character]]
+    if not glyphs:
+        raise SystemExit("No timestamps could be matched to their glyphs")
+    GlyphBank(glyphs, labels).save(args.output)
+    print(f"{len(glyphs)} glyphs from {used} images: "
+          + ", ".join(f"'{character}': {len(examples[character])}" for character in sorted(examples)))
+    print("Glyph bank written to", args.output)
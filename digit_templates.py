@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+# Tally timestamps are printed in one thermal-printer font, so most of them can be read by
+# matching each glyph against examples cut from timestamps that were already validated.
+# Crops that do not match well are rejected and left to Tesseract.
+
+# Every glyph is scaled by its line height and centred in a GLYPH_SIZE x GLYPH_SIZE cell,
+# which keeps a colon narrow and its dots at mid-height
+GLYPH_SIZE = 24
+
+# Mean squared difference (pixels in 0..1) above which a glyph is not trusted
+MAX_DISTANCE = 0.09
+
+
+def binarize(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return ink
+
+
+def runs(mask, min_length=1):
+    """(start, end) of every run of True values in a 1-D mask."""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+    return [(start, end) for start, end in zip(edges[::2], edges[1::2]) if end - start >= min_length]
+
+
+def normalize_glyph(glyph, line_height):
+    scale = GLYPH_SIZE / line_height
+    width = min(GLYPH_SIZE, max(1, round(glyph.shape[1] * scale)))
+    resized = cv2.resize(glyph.astype(np.float32), (width, GLYPH_SIZE), interpolation=cv2.INTER_AREA)
+    cell = np.zeros((GLYPH_SIZE, GLYPH_SIZE), dtype=np.float32)
+    left = (GLYPH_SIZE - width) // 2
+    cell[:, left:left + width] = resized
+    return cell.ravel()
+
+
+def segment_lines(image, min_height=6):
+    """Glyph vectors of every text line in a crop, one (glyph count, GLYPH_SIZE**2) array per line.
+
+    Lines are runs of rows with ink and glyphs are runs of columns with ink inside a line;
+    the font's fixed spacing keeps the glyphs of a timestamp apart.
+    """
+    ink = binarize(image)
+    lines = []
+    for top, bottom in runs(ink.any(axis=1), min_height):
+        line = ink[top:bottom]
+        glyphs = [normalize_glyph(line[:, left:right], bottom - top) for left, right in runs(line.any(axis=0))]
+        lines.append(np.array(glyphs))
+    return lines
+
+
+class GlyphBank:
+    """Labelled glyph examples and a vectorized nearest-neighbour classifier over them."""
+
+    def __init__(self, glyphs, labels):
+        self.glyphs = np.asarray(glyphs, dtype=np.float32)
+        self.labels = np.asarray(labels)
+        self.norms = (self.glyphs ** 2).sum(axis=1)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as bank:
+            return cls(bank['glyphs'], bank['labels'])
+
+    def save(self, path):
+        np.savez_compressed(path, glyphs=self.glyphs, labels=self.labels)
+
+    def classify(self, glyphs):
+        """Label of the nearest example for every glyph, and its mean squared distance."""
+        # |a - b|^2 = |a|^2 - 2ab + |b|^2 for all glyph/example pairs in one matrix product
+        distances = (glyphs ** 2).sum(axis=1)[:, None] - 2 * glyphs @ self.glyphs.T + self.norms[None, :]
+        nearest = distances.argmin(axis=1)
+        return self.labels[nearest], np.maximum(distances[np.arange(len(glyphs)), nearest], 0) / glyphs.shape[1]
+
+    def read(self, image, pattern, max_distance=MAX_DISTANCE):
+        """Timestamp text matched by `pattern` in a crop and a 0-100 confidence, or (None, None).
+
+        Glyphs farther than `max_distance` from every example read as '?', so a line only
+        yields a timestamp when every glyph of it was recognized.
+        """
+        for glyphs in segment_lines(image):
+            if len(glyphs) < 5:
+                continue
+            labels, distances = self.classify(glyphs)
+            text = ''.join(label if distance <= max_distance else '?' for label, distance in zip(labels, distances))
+            match = pattern.search(text)
+            if match:
+                worst = distances[match.start():match.end()].max()
+                return match.group(0), round(float(100 * (1 - worst / max_distance)), 1)
+        return None, None
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from downloader import Manifest, RetryPolicy, download_all
+from ocr_metrics import MetricsLog
+from timestamp_ocr import (BACKENDS, DEFAULT_PREPROCESS, INITIAL_CROP_BOX, PREPROCESS_STAGES, check_backend,
+                           configure_ocr, empty_result, extract_filename, learn_from_result, limit_engine_threads,
+                           load_layout_cache, ocr_file, parse_box, parse_stages, save_layout_cache)
+
+# Runs get-images.py and ocr-time.py as one pipeline: every finished download is
+# pushed onto a bounded queue and OCR workers consume it straight away. When the
+# queue is full the downloader stops starting new requests until OCR catches up.
+
+def read_done_urls(output_csv):
+    # URLs that already have a timestamp are neither downloaded nor OCR'ed again
+    done = set()
+    if os.path.exists(output_csv):
+        with open(output_csv, 'r', newline='', encoding='utf-8') as existing_file:
+            for row in csv.DictReader(existing_file):
+                if row['timestamp'] != "NF":
+                    done.add(row['URL'])
+    return done
+
+def read_header(output_csv):
+    # Rows appended to an earlier output must follow its column order, not the input's
+    if os.path.exists(output_csv):
+        with open(output_csv, 'r', newline='', encoding='utf-8') as existing_file:
+            return next(csv.reader(existing_file), None)
+    return None
+
+async def main(args):
+    os.makedirs(args.image_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(args.image_dir, 'manifest.sqlite'))
+    seen_urls = read_done_urls(args.output)
+    layout_cache = load_layout_cache(args.layout_cache)
+    # Same sidecar as ocr-time.py, so triage-nf.py can tell images never OCR'ed from unreadable ones
+    metrics = MetricsLog(args.metrics)
+    queue = asyncio.Queue(maxsize=args.queue_size)
+    rows_in_flight = {}
+    loop = asyncio.get_running_loop()
+
+    input_file = open(args.csv, 'r', newline='', encoding='utf-8')
+    reader = csv.DictReader(input_file)
+    fieldnames = read_header(args.output)
+    write_header = not fieldnames
+    if write_header:
+        fieldnames = list(reader.fieldnames)
+        if 'timestamp' not in fieldnames:
+            fieldnames.append('timestamp')
+
+    def iter_jobs():
+        for row in reader:
+            url = row['URL']
+            # A URL listed twice is downloaded and OCR'ed once
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+            rows_in_flight[url] = row
+            yield url, os.path.join(args.image_dir, extract_filename(url))
+
+    # Results are appended; ocr-time.py already keeps the best row per URL
+    with open(args.output, 'a', newline='', encoding='utf-8') as outfile, \
+            ProcessPoolExecutor(max_workers=args.ocr_workers,
+                                initializer=partial(configure_ocr, backend=args.backend, config=args.tesseract_config,
+                                                    save_rotated=args.save_rotated,
+                                                    layout_cache_path=args.layout_cache,
+                                                    preprocess=args.preprocess, ocr_cache_path=args.ocr_cache,
+                                                    ocr_cache_size=args.ocr_cache_size)) as pool:
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames, extrasaction='ignore')
+        if write_header:
+            writer.writeheader()
+
+        def write_row(row, timestamp):
+            row['timestamp'] = timestamp
+            writer.writerow(row)
+            outfile.flush()
+            print(f"Processed: {extract_filename(row['URL'])}, Timestamp: {timestamp}")
+
+        async def enqueue(result):
+            row = rows_in_flight.pop(result['url'])
+            if result['status'] == 'failed':
+                write_row(row, "NF")
+            else:
+                await queue.put((row, result['path']))  # Blocks while OCR is behind
+
+        async def ocr_worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                row, image_path = item
+                try:
+                    result = await loop.run_in_executor(pool, ocr_file, image_path, args.initial_box)
+                except Exception as e:
+                    # Leave the row as NF so ocr-time.py can pick it up again later
+                    print(f"Failed to OCR {image_path}: {e}")
+                    result = empty_result()
+                learn_from_result(layout_cache, result)
+                metrics.record(row['URL'], result)
+                if result['rotation']:
+                    print(f"Image was rotated: {extract_filename(row['URL'])}")
+                write_row(row, result['timestamp'])
+
+        workers = [asyncio.create_task(ocr_worker()) for _ in range(args.ocr_workers)]
+        try:
+            counts = await download_all(iter_jobs(), manifest, rate=args.rate, max_connections=args.connections,
+                                        per_host=args.per_host, timeout=args.timeout, window=args.window,
+                                        policy=RetryPolicy(), on_result=enqueue, verbose=False)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            input_file.close()
+            manifest.close()
+            metrics.close()
+            save_layout_cache(args.layout_cache, layout_cache)
+    print(", ".join(f"{status}: {count}" for status, count in sorted(counts.items())))
+    for line in metrics.summary():
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download tally images and OCR them as they arrive.")
+    parser.add_argument('--csv', default="resultados-macedonia-del-norte.csv", help="CSV file with a URL column")
+    parser.add_argument('--output', default="resultados-with-timestamps.csv")
+    parser.add_argument('--image-dir', default="downloaded_images")
+    parser.add_argument('--ocr-workers', type=int, default=os.cpu_count(), help="Number of OCR processes")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='pytesseract',
+                        help="OCR engine: a tesseract process per call, or one engine kept loaded per worker")
+    parser.add_argument('--tesseract-config', default='', help="Extra tesseract options, e.g. \"--psm 6\"")
+    parser.add_argument('--save-rotated', action='store_true',
+                        help="Also write a _rotated copy of the images that had to be rotated")
+    parser.add_argument('--initial-box', type=parse_box, default=INITIAL_CROP_BOX,
+                        help="Crop box tried first on images of a layout not learned yet, as left:top:right:bottom "
+                             f"(default: {':'.join(map(str, INITIAL_CROP_BOX))})")
+    parser.add_argument('--preprocess', type=parse_stages, default=DEFAULT_PREPROCESS,
+                        help="Comma-separated preprocessing ladder tried when the raw crop fails "
+                             f"(stages: {', '.join(PREPROCESS_STAGES)}; \"\" = off)")
+    parser.add_argument('--ocr-cache', default="ocr_cache.sqlite",
+                        help="SQLite file with the OCR text of every crop already read (\"\" = off)")
+    parser.add_argument('--ocr-cache-size', type=int, default=1_000_000,
+                        help="Crops kept in the OCR cache before the least recently used are evicted")
+    parser.add_argument('--layout-cache', default="layout_cache.json",
+                        help="File with the crop boxes and orientation profiles learned per image layout")
+    parser.add_argument('--metrics', default="ocr-metrics.jsonl",
+                        help="Sidecar file with per-image stage timings and the winning strategy (\"\" = off)")
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help="Downloaded images allowed to wait for OCR before the downloader pauses")
+    parser.add_argument('--rate', type=float, default=20, help="Maximum requests per second (0 = unlimited)")
+    parser.add_argument('--connections', type=int, default=16, help="Size of the shared connection pool")
+    parser.add_argument('--per-host', type=int, default=8, help="Maximum concurrent connections per host")
+    parser.add_argument('--timeout', type=float, default=10, help="Connect/read timeout in seconds")
+    parser.add_argument('--window', type=int, default=32, help="Maximum number of downloads in flight")
+    args = parser.parse_args()
+    try:
+        check_backend(args.backend, args.tesseract_config)
+    except (RuntimeError, OSError) as e:
+        raise SystemExit(f"Cannot start the {args.backend} OCR engine: {e}")
+    if args.ocr_workers > 1:
+        limit_engine_threads()
+
+    asyncio.run(main(args))
+    print("Processing complete. Results written to", args.output)
@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return  # Unlimited
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Manifest:
+    """Record of every download (URL -> size, ETag/Last-Modified, SHA-256, status) kept in SQLite."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS downloads (
+            url TEXT PRIMARY KEY, path TEXT, size INTEGER, etag TEXT,
+            last_modified TEXT, sha256 TEXT, status TEXT, updated REAL)''')
+        self.db.commit()
+
+    def get(self, url):
+        row = self.db.execute('SELECT * FROM downloads WHERE url = ?', (url,)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, url, path, status, size=None, etag=None, last_modified=None, sha256=None):
+        self.db.execute('''INSERT OR REPLACE INTO downloads
+            (url, path, size, etag, last_modified, sha256, status, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (url, path, size, etag, last_modified, sha256, status, time.time()))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def is_complete(record, save_path):
+    # A completed download only needs a stat call to be trusted again
+    if not record or record['status'] != 'complete':
+        return False
+    try:
+        return os.stat(save_path).st_size == record['size']
+    except OSError:
+        return False
+
+
+def hash_file(path, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256
+
+
+def resume_headers(record, part_path):
+    """Range headers to continue a partial download, or None to start from scratch."""
+    if not record or not os.path.exists(part_path):
+        return None
+    # Weak ETags are not allowed in If-Range, fall back to Last-Modified
+    validator = record['etag'] if record['etag'] and not record['etag'].startswith('W/') else record['last_modified']
+    offset = os.path.getsize(part_path)
+    if not validator or not offset:
+        return None
+    return {'Range': f'bytes={offset}-', 'If-Range': validator}
+
+
+class RetryPolicy:
+    """Retry budget per error class, with jittered exponential backoff between attempts."""
+
+    # Client errors (404, 403...) and local disk errors are permanent and never retried
+    DEFAULT_BUDGETS = {'timeout': 4, 'connection': 4, 'server': 3, 'throttled': 8}
+
+    def __init__(self, budgets=None, base_delay=0.5, max_delay=60):
+        self.budgets = dict(self.DEFAULT_BUDGETS, **(budgets or {}))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error_class, attempts):
+        return attempts <= self.budgets.get(error_class, 0)
+
+    def delay(self, attempts, retry_after=None):
+        # "Full jitter": a random wait up to the exponential bound, but never less than Retry-After
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempts))
+        return max(backoff, retry_after or 0)
+
+
+def classify_error(error):
+    if isinstance(error, aiohttp.ClientResponseError):
+        if error.status == 429:
+            return 'throttled'
+        return 'server' if error.status >= 500 else 'client'
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ServerTimeoutError)):
+        return 'timeout'
+    if isinstance(error, aiohttp.ClientError):
+        return 'connection'
+    return 'local'
+
+
+def parse_retry_after(error):
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP date), if any."""
+    headers = getattr(error, 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def create_session(max_connections, per_host, timeout):
+    # One keep-alive connection pool shared by every download
+    connector = aiohttp.TCPConnector(limit=max_connections, limit_per_host=per_host)
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=client_timeout)
+
+
+async def download_image(session, bucket, manifest, url, save_path, adopt_existing=False, chunk_size=65536):
+    result = {'url': url, 'path': save_path, 'status': 'downloaded', 'bytes': 0, 'error': None,
+              'error_class': None, 'retry_after': None, 'elapsed': 0.0}
+    record = manifest.get(url)
+    if is_complete(record, save_path):
+        result['status'] = 'skipped'
+        return result
+    if record is None and adopt_existing and os.path.exists(save_path):
+        # Files fetched before the manifest existed are trusted as-is
+        manifest.record(url, save_path, 'complete', size=os.path.getsize(save_path),
+                        sha256=hash_file(save_path).hexdigest())
+        result['status'] = 'skipped'
+        return result
+
+    # Data goes to a .part file that is only renamed into place once complete
+    part_path = save_path + '.part'
+    headers = resume_headers(record, part_path)
+    await bucket.acquire()
+    start = time.perf_counter()
+    try:
+        while True:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 416 and headers:
+                    # The partial file no longer matches the remote one; start over straight away
+                    os.remove(part_path)
+                    headers = None
+                    await bucket.acquire()
+                    continue
+                response.raise_for_status()
+                resuming = response.status == 206
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                manifest.record(url, save_path, 'partial', etag=etag, last_modified=last_modified)
+                sha256 = hash_file(part_path) if resuming else hashlib.sha256()
+                with open(part_path, 'ab' if resuming else 'wb') as img_file:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        img_file.write(chunk)
+                        sha256.update(chunk)
+                        result['bytes'] += len(chunk)
+            break
+        os.replace(part_path, save_path)
+        manifest.record(url, save_path, 'complete', size=os.path.getsize(save_path), etag=etag,
+                        last_modified=last_modified, sha256=sha256.hexdigest())
+        if resuming:
+            result['status'] = 'resumed'
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+        result['status'] = 'failed'
+        result['error'] = str(e) or type(e).__name__
+        result['error_class'] = classify_error(e)
+        result['retry_after'] = parse_retry_after(e)
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+
+async def download_with_retries(session, bucket, manifest, policy, url, save_path, adopt_existing=False):
+    # Each error class spends its own budget; a retry resumes from the .part file
+    attempts = Counter()
+    elapsed = 0.0
+    while True:
+        result = await download_image(session, bucket, manifest, url, save_path, adopt_existing)
+        elapsed += result['elapsed']
+        if result['status'] != 'failed':
+            break
+        error_class = result['error_class']
+        attempts[error_class] += 1
+        if not policy.should_retry(error_class, attempts[error_class]):
+            break
+        await asyncio.sleep(policy.delay(attempts[error_class], result['retry_after']))
+    result['retries'] = sum(attempts.values()) - (result['status'] == 'failed')
+    result['elapsed'] = elapsed  # Time spent on requests, without backoff or rate-limit waits
+    return result
+
+
+def format_result(result):
+    if result['status'] == 'failed':
+        return f"Failed to download {result['url']} after {result['retries'] + 1} attempt(s): {result['error']}"
+    if result['status'] == 'skipped':
+        return f"Skipping already downloaded file: {os.path.basename(result['path'])}"
+    if result['status'] == 'resumed':
+        return f"Resumed: {os.path.basename(result['path'])}"
+    return f"Downloaded: {os.path.basename(result['path'])}"
+
+
+def write_failure(ledger_file, result):
+    entry = {key: result[key] for key in ('url', 'path', 'error_class', 'error', 'retries')}
+    entry['time'] = time.time()
+    ledger_file.write(json.dumps(entry) + '\n')
+
+
+def load_failures(ledger_path):
+    """(url, save_path) pairs from a failure ledger, once per URL and in first-seen order."""
+    failures = {}
+    if os.path.exists(ledger_path):
+        with open(ledger_path, 'r', encoding='utf-8') as ledger_file:
+            for line in ledger_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    failures.setdefault(entry['url'], entry['path'])
+    return list(failures.items())
+
+
+async def download_all(jobs, manifest, rate=20, max_connections=16, per_host=8, timeout=10,
+                       window=256, log_file=None, ledger_file=None, policy=None, adopt_existing=False,
+                       on_result=None, verbose=True):
+    """Download every (url, save_path) pair in `jobs` and report each result as it completes.
+
+    `jobs` is consumed lazily and at most `window` downloads are in flight at any time,
+    so memory use stays flat however long the input is. Downloads that still fail once
+    their retry budget is spent are written to `ledger_file`. `on_result`, if given, is
+    awaited with every result. Returns a count per status.
+    """
+    bucket = TokenBucket(rate)
+    policy = policy or RetryPolicy()
+    counts = Counter()
+
+    async def report(done):
+        for task in done:
+            result = task.result()
+            counts[result['status']] += 1
+            counts['retries'] += result['retries']
+            if verbose:
+                print(format_result(result))
+            if log_file:
+                log_file.write(json.dumps(result) + '\n')
+            if ledger_file and result['status'] == 'failed':
+                write_failure(ledger_file, result)
+            if on_result:
+                await on_result(result)
+
+    async def after(previous, download):
+        # Jobs that save to the same file run one after another, so they never share a .part file
+        await asyncio.wait([previous])
+        return await download
+
+    pending = set()
+    in_flight = {}
+    async with create_session(max_connections, per_host, timeout) as session:
+        for url, save_path in jobs:
+            if len(pending) >= window:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                await report(done)
+            download = download_with_retries(session, bucket, manifest, policy, url, save_path, adopt_existing)
+            previous = in_flight.get(save_path)
+            task = asyncio.create_task(after(previous, download) if previous else download)
+            in_flight[save_path] = task
+            task.add_done_callback(lambda task, path=save_path: in_flight.pop(path, None)
+                                   if in_flight.get(path) is task else None)
+            pending.add(task)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            await report(done)
+    return counts
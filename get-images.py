@@ -1,51 +1,80 @@
+import argparse
+import asyncio
 import csv
 import os
-import requests
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-def download_image(url, save_path):
-    try:
-        response = requests.get(url, stream=True, timeout=10)
-        response.raise_for_status()
-        with open(save_path, 'wb') as img_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                img_file.write(chunk)
-        return f"Downloaded: {os.path.basename(save_path)}"
-    except requests.exceptions.RequestException as e:
-        return f"Failed to download {url}: {str(e)}"
+
+from downloader import Manifest, RetryPolicy, download_all, load_failures
 
 def process_row(row, image_dir):
     image_url = row['URL']
     filename = os.path.basename(image_url)
     save_path = os.path.join(image_dir, filename)
-    return download_image(image_url, save_path)
+    return image_url, save_path
+
+def iter_jobs(csv_file, image_dir):
+    # Read the CSV lazily so only the rows in flight are held in memory
+    with open(csv_file, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            yield process_row(row, image_dir)
 
 # Get the current directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Path to the CSV file
-csv_file = os.path.join(current_dir, 'resultados-macedonia-del-norte.csv')
+parser = argparse.ArgumentParser(description="Download the tally images listed in the results CSV.")
+parser.add_argument('--csv', default=os.path.join(current_dir, 'resultados-macedonia-del-norte.csv'),
+                    help="CSV file with a URL column")
+parser.add_argument('--rate', type=float, default=20, help="Maximum requests per second (0 = unlimited)")
+parser.add_argument('--connections', type=int, default=16, help="Size of the shared connection pool")
+parser.add_argument('--per-host', type=int, default=8, help="Maximum concurrent connections per host")
+parser.add_argument('--timeout', type=float, default=10, help="Connect/read timeout in seconds")
+parser.add_argument('--window', type=int, default=256, help="Maximum number of downloads in flight")
+parser.add_argument('--log', default=os.path.join(current_dir, 'download-log.jsonl'),
+                    help="File that receives one JSON line per finished download")
+parser.add_argument('--ledger', default=os.path.join(current_dir, 'failed_downloads.jsonl'),
+                    help="JSON-lines file that receives the URLs that could not be downloaded")
+parser.add_argument('--retry-failed', action='store_true',
+                    help="Only download the URLs recorded in the failure ledger")
+parser.add_argument('--retry-budget', action='append', default=[], metavar='CLASS=N',
+                    help="Retries allowed per error class (timeout, connection, server, throttled)")
+parser.add_argument('--adopt-existing', action='store_true',
+                    help="Trust images downloaded before the manifest existed instead of fetching them again")
+args = parser.parse_args()
 
 # Create a directory to store downloaded images
 image_dir = os.path.join(current_dir, 'downloaded_images')
 os.makedirs(image_dir, exist_ok=True)
 
-# Open and read the CSV file
-with open(csv_file, 'r', encoding='utf-8') as file:
-    csv_reader = csv.DictReader(file)
-    rows = list(csv_reader)
-
-# Set up threading pool
-max_workers = 5  # Limit concurrent connections
-with ThreadPoolExecutor(max_workers=max_workers) as executor:
-    futures = [executor.submit(process_row, row, image_dir) for row in rows]
-    
-    # Process results as they complete
-    for future in as_completed(futures):
-        print(future.result())
-        time.sleep(0.1)  # Add a small delay between requests
+# The manifest lets re-runs skip completed files and resume partial ones
+manifest = Manifest(os.path.join(image_dir, 'manifest.sqlite'))
 
-print("Image download complete.")
+budgets = {name: int(count) for name, count in (budget.split('=') for budget in args.retry_budget)}
+policy = RetryPolicy(budgets)
+
+if args.retry_failed:
+    # Replay only the ledger; the URLs that still fail make up the new ledger
+    jobs = load_failures(args.ledger)
+    ledger_path = args.ledger + '.tmp'
+    ledger_mode = 'w'
+    print(f"Retrying {len(jobs)} failed downloads from {args.ledger}")
+else:
+    jobs = iter_jobs(args.csv, image_dir)
+    ledger_path = args.ledger
+    ledger_mode = 'a'
 
+# The token bucket paces requests; the connection pool caps concurrency per host
+try:
+    with open(args.log, 'a', buffering=1, encoding='utf-8') as log_file, \
+            open(ledger_path, ledger_mode, buffering=1, encoding='utf-8') as ledger_file:
+        counts = asyncio.run(download_all(jobs, manifest, rate=args.rate, max_connections=args.connections,
+                                          per_host=args.per_host, timeout=args.timeout, window=args.window,
+                                          log_file=log_file, ledger_file=ledger_file, policy=policy,
+                                          adopt_existing=args.adopt_existing))
+finally:
+    manifest.close()
 
+if args.retry_failed:
+    os.replace(ledger_path, args.ledger)
+
+print(", ".join(f"{status}: {count}" for status, count in sorted(counts.items())))
+
+print("Image download complete.")
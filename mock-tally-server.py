@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import random
+import time
+
+import numpy as np
+from aiohttp import web
+from PIL import Image, ImageDraw, ImageFont
+
+# Local stand-in for the tally image servers, used to benchmark get-images.py
+# without touching the real ones. Every path under /actas/ returns a synthetic
+# tally JPEG; latency, bandwidth, errors and rate limiting are configurable.
+
+def make_tally_image(seed, width=1000, height=2400, noise=12):
+    rng = np.random.default_rng(seed)
+    # Paper-white background with sensor noise, so the JPEG size resembles a real scan
+    pixels = np.clip(235 + rng.normal(0, noise, (height, width)), 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels, 'L').convert('RGB')
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.load_default(size=36)
+    except TypeError:
+        font = ImageFont.load_default()
+    # The timestamp sits inside the crop box ocr-time.py tries first
+    timestamp = f"{rng.integers(18, 24):02d}:{rng.integers(0, 60):02d}:{rng.integers(0, 60):02d}"
+    draw.text((330, 480), timestamp, fill=(20, 20, 20), font=font)
+    for line in range(30):
+        y = 700 + line * 55
+        draw.text((80, y), "#" * int(rng.integers(10, 40)), fill=(40, 40, 40), font=font)
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+class RateLimiter:
+    """Non-blocking token bucket: requests over the limit are rejected, not queued."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = max(1, rate)
+        self.updated = time.monotonic()
+
+    def try_acquire(self):
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(max(1, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def parse_range(header, size):
+    # Only the "bytes=start-" and "bytes=start-end" forms the downloader sends
+    if not header or not header.startswith('bytes='):
+        return None
+    start, _, end = header[len('bytes='):].partition('-')
+    start = int(start)
+    end = int(end) if end else size - 1
+    return start, min(end, size - 1)
+
+
+async def serve_image(request):
+    config = request.app['config']
+    stats = request.app['stats']
+    stats['requests'] += 1
+
+    if not request.app['limiter'].try_acquire():
+        stats['throttled'] += 1
+        return web.Response(status=429, headers={'Retry-After': '1'})
+
+    latency = max(0.0, random.gauss(config.latency, config.jitter)) / 1000
+    await asyncio.sleep(latency)
+
+    if random.random() < config.error_rate:
+        stats['errors'] += 1
+        return web.Response(status=random.choice([500, 502, 503]))
+
+    images = request.app['images']
+    name = request.match_info['name']
+    body, etag = images[int(hashlib.md5(name.encode()).hexdigest(), 16) % len(images)]
+
+    status = 200
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'Content-Type': 'image/jpeg'}
+    byte_range = None
+    if request.headers.get('If-Range', etag) == etag:
+        byte_range = parse_range(request.headers.get('Range'), len(body))
+    if byte_range:
+        start, end = byte_range
+        if start >= len(body):
+            return web.Response(status=416, headers={'Content-Range': f'bytes */{len(body)}'})
+        headers['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+        body = body[start:end + 1]
+        status = 206
+
+    headers['Content-Length'] = str(len(body))
+    response = web.StreamResponse(status=status, headers=headers)
+    await response.prepare(request)
+    chunk_size = 16384
+    for offset in range(0, len(body), chunk_size):
+        await response.write(body[offset:offset + chunk_size])
+        if config.bandwidth > 0:
+            await asyncio.sleep(chunk_size / (config.bandwidth * 1024))
+    await response.write_eof()
+    stats['served'] += 1
+    stats['bytes'] += len(body)
+    return response
+
+
+async def serve_stats(request):
+    return web.json_response(request.app['stats'])
+
+
+def create_app(config):
+    app = web.Application()
+    app['config'] = config
+    app['limiter'] = RateLimiter(config.rate_limit)
+    app['stats'] = {'requests': 0, 'served': 0, 'throttled': 0, 'errors': 0, 'bytes': 0}
+    app['images'] = []
+    for seed in range(config.variants):
+        body = make_tally_image(seed)
+        app['images'].append((body, f'"{hashlib.sha256(body).hexdigest()[:16]}"'))
+    app.router.add_get('/actas/{name}', serve_image)
+    app.router.add_get('/stats', serve_stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic tally images for download benchmarks.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=50, help="Mean response latency in ms")
+    parser.add_argument('--jitter', type=float, default=20, help="Standard deviation of the latency in ms")
+    parser.add_argument('--bandwidth', type=float, default=0, help="Per-response bandwidth in KB/s (0 = unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 5xx")
+    parser.add_argument('--rate-limit', type=float, default=0, help="Requests per second before answering 429 (0 = off)")
+    parser.add_argument('--variants', type=int, default=8, help="Number of distinct synthetic images")
+    config = parser.parse_args()
+
+    print(f"Serving synthetic tally images on http://{config.host}:{config.port}/actas/")
+    web.run_app(create_app(config), host=config.host, port=config.port, print=None)
@@ -1,98 +1,353 @@
+import argparse
 import os
-import re
 import csv
-from urllib.parse import urlparse
-from PIL import Image
-import pytesseract
-
-# Set the path to the Tesseract executable if it's not in your PATH
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-
-def extract_timestamp(image_path, box):
-    with Image.open(image_path) as img:
-        cropped = img.crop(box)
-        text = pytesseract.image_to_string(cropped)
-        time_pattern = r'\b([01]\d|2[0-3]):([0-5]\d)(:([0-5]\d))?\b'
-        matches = re.findall(time_pattern, text)
-        return ':'.join(filter(None, matches[0])) if matches else "NF"
-
-def extract_filename(url):
-    return os.path.basename(urlparse(url).path)
-
-def process_image(image_path, initial_box, larger_box):
-    # Try with initial box
-    timestamp = extract_timestamp(image_path, initial_box)
-    if timestamp != "NF":
-        return timestamp, False
-
-    # Try with larger box
-    timestamp = extract_timestamp(image_path, larger_box)
-    if timestamp != "NF":
-        return timestamp, False
-
-    # If still not found, try rotating the image
-    file_name, file_extension = os.path.splitext(image_path)
-    rotated_img_path = f"{file_name}_rotated{file_extension}"
-    
-    with Image.open(image_path) as img:
-        rotated_img = img.rotate(180)
-        rotated_img.save(rotated_img_path)
-
-    # Try OCR on rotated image
-    timestamp = extract_timestamp(rotated_img_path, initial_box)
-    if timestamp == "NF":
-        timestamp = extract_timestamp(rotated_img_path, larger_box)
-
-    return timestamp, True
-
-# Define the initial crop box
-initial_crop_box = (300, 400, 650, 600)
-
-# Input and output CSV files
-input_csv = "resultados-macedonia-del-norte.csv"
-output_csv = "resultados-with-timestamps.csv"
-
-# Image directory
-image_dir = "downloaded_images"
-
-# Read all existing data from the output CSV if it exists
-existing_data = {}
-if os.path.exists(output_csv):
-    with open(output_csv, 'r', newline='', encoding='utf-8') as existing_file:
-        reader = csv.DictReader(existing_file)
-        for row in reader:
-            url = row['URL']
-            if url not in existing_data or row['timestamp'] != "NF":
-                existing_data[url] = row
-
-# Process images and update existing data
-for url, row in existing_data.items():
-    filename = extract_filename(url)
-    image_path = os.path.join(image_dir, filename)
-    
-    if row['timestamp'] != "NF":
-        print(f"Skipping already processed file: {filename}")
-        continue
-    
-    if os.path.exists(image_path):
-        with Image.open(image_path) as img:
-            width, height = img.size
-            larger_crop_box = (0, 0, width, height // 4)
-        
-        timestamp, was_rotated = process_image(image_path, initial_crop_box, larger_crop_box)
-        if was_rotated:
-            print(f"Image was rotated: {filename}")
+import json
+import socket
+import time
+from collections import Counter
+from functools import partial
+from itertools import chain
+from multiprocessing import Pool
+
+from ocr_metrics import MetricsLog
+
+from timestamp_ocr import (BACKENDS, DEFAULT_PREPROCESS, INITIAL_CROP_BOX, PREPROCESS_STAGES, check_backend,
+                           close_ocr_cache, configure_ocr, empty_result, extract_filename, learn_from_result,
+                           load_layout_cache, ocr_batch, ocr_file, limit_engine_threads, parse_box, parse_stages,
+                           rescue_file, save_layout_cache, unreadable_image)
+from work_queue import WorkQueue
+
+def ocr_task(image_path, read=ocr_file, initial_box=INITIAL_CROP_BOX):
+    if not os.path.exists(image_path):
+        return empty_result()
+    try:
+        return read(image_path, initial_box)
+    except OSError as e:
+        # A truncated or garbage file (e.g. left behind by a killed download) is recorded as NF
+        # instead of stopping the whole run
+        if not unreadable_image(e):
+            raise
+        print(f"Could not read {image_path}: {e}")
+        return empty_result()
+
+def rescue_task(image_path, initial_box=INITIAL_CROP_BOX):
+    return ocr_task(image_path, read=rescue_file, initial_box=initial_box)
+
+def replay_journal(journal_path):
+    """Results (timestamp and confidence) of the images a previous, interrupted run already OCR'ed."""
+    done = {}
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r', encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # The last line may have been cut short by the crash
+                done[entry['URL']] = entry
+    return done
+
+def trim_journal(journal_path, chunk_size=4096):
+    """Cut off a last line a crash left unfinished, so the next entry starts on a line of its own."""
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'rb+') as journal:
+        position = journal.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - chunk_size)
+            journal.seek(start)
+            newline = journal.read(position - start).rfind(b'\n')
+            if newline != -1:
+                journal.truncate(start + newline + 1)
+                return
+            position = start
+        journal.truncate(0)
+
+def read_results(output_csv):
+    # Best row per URL from earlier runs: a timestamp wins over NF
+    existing_data = {}
+    if os.path.exists(output_csv):
+        with open(output_csv, 'r', newline='', encoding='utf-8') as existing_file:
+            for row in csv.DictReader(existing_file):
+                url = row['URL']
+                if url not in existing_data or row['timestamp'] != "NF":
+                    existing_data[url] = row
+    return existing_data
+
+def join_input(input_csv, existing_data):
+    """Stream the input CSV and add the URLs missing from `existing_data` as NF rows.
+
+    The previous results are the hash table of the join, so every input row costs one
+    dict lookup and only new URLs (plus the old NF rows) end up scheduled for OCR.
+    """
+    new = 0
+    if not os.path.exists(input_csv):
+        return new
+    with open(input_csv, 'r', newline='', encoding='utf-8') as input_file:
+        for row in csv.DictReader(input_file):
+            prior = existing_data.get(row['URL'])
+            if prior is None:
+                row['timestamp'] = "NF"
+                existing_data[row['URL']] = row
+                new += 1
+            else:
+                # Input columns added since the earlier run are filled in
+                for key, value in row.items():
+                    prior.setdefault(key, value)
+    return new
+
+def dispatch(pool, image_paths, montage=0, chunksize=8, task=ocr_task, initial_box=INITIAL_CROP_BOX):
+    """OCR results of `image_paths` in input order, on the pool or in this process."""
+    if montage:
+        # Each task is a whole montage; the per-image results are flattened back in input order
+        batches = [image_paths[i:i + montage] for i in range(0, len(image_paths), montage)]
+        batch = partial(ocr_batch, initial_box=initial_box)
+        return chain.from_iterable(pool.imap(batch, batches) if pool else map(batch, batches))
+    task = partial(task, initial_box=initial_box)
+    if pool:
+        return pool.imap(task, image_paths, chunksize=chunksize)
+    return map(task, image_paths)
+
+def leased_results(queue, existing_data, run, lease_size, image_dir):
+    """(row, result) of every image leased from the work queue, `lease_size` images at a time.
+
+    The lease is renewed while its images are OCR'ed and the rows are committed to the
+    queue once all of them were handed out, so an interrupted node leaves its batch to
+    the others. Rows the caller updated with the result are what gets committed.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        lease_id, urls = queue.lease(worker, lease_size)
+        if not urls:
+            if not queue.counts()['leased']:
+                return
+            # Other nodes still hold leases; they come back here if those nodes die
+            time.sleep(queue.lease_seconds / 3)
+            continue
+        rows = [existing_data.setdefault(url, {'URL': url, 'timestamp': "NF"}) for url in urls]
+        with queue.keep_alive(lease_id):
+            image_paths = [os.path.join(image_dir, extract_filename(url)) for url in urls]
+            for row, result in zip(rows, run(image_paths)):
+                yield row, result
+        entries = {row['URL']: {key: row[key] for key in ('timestamp', 'confidence') if key in row} for row in rows}
+        if not queue.complete(lease_id, entries):
+            print(f"Lease of {len(urls)} images expired before it was committed; another node redoes them")
+
+def write_csv(path, rows):
+    # Write to a temporary file first, so a crash never leaves a half-written CSV behind
+    # Rows joined in from the input CSV may bring columns the earlier results did not have
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row)) or ['URL', 'timestamp']
+    with open(path + '.tmp', 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(path + '.tmp', path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract timestamps from the downloaded tally images.")
+    parser.add_argument('--csv', default="resultados-macedonia-del-norte.csv",
+                        help="CSV file with a URL column; URLs not in the output yet are OCR'ed")
+    parser.add_argument('--output', default="resultados-with-timestamps.csv",
+                        help="CSV file with the results of earlier runs, updated in place")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Number of OCR processes (1 = run serially in this process)")
+    parser.add_argument('--chunksize', type=int, default=8, help="Images sent to a worker at a time")
+    parser.add_argument('--initial-box', type=parse_box, default=INITIAL_CROP_BOX,
+                        help="Crop box tried first on images of a layout not learned yet, as left:top:right:bottom "
+                             f"(default: {':'.join(map(str, INITIAL_CROP_BOX))})")
+    parser.add_argument('--glyph-bank', default="glyph_bank.npz",
+                        help="Glyph examples from build-glyph-bank.py; crops they read skip Tesseract (\"\" = off)")
+    parser.add_argument('--montage', type=int, default=0,
+                        help="Read the first crop of this many images with a single OCR call on a tiled montage, "
+                             "split into several montages past Tesseract's 32767 px limit (0 = one call per crop)")
+    parser.add_argument('--speculative', type=int, default=0,
+                        help="Threads per worker that run the fallbacks of a hard image at the same time; "
+                             "the first valid read wins (0 = one after another)")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='pytesseract',
+                        help="OCR engine: a tesseract process per call, or one engine kept loaded per worker")
+    parser.add_argument('--tesseract-config', default='', help="Extra tesseract options, e.g. \"--psm 6\"")
+    parser.add_argument('--save-rotated', action='store_true',
+                        help="Also write a _rotated copy of the images that had to be rotated")
+    parser.add_argument('--preprocess', type=parse_stages, default=DEFAULT_PREPROCESS,
+                        help="Comma-separated preprocessing ladder tried when the raw crop fails "
+                             f"(stages: {', '.join(PREPROCESS_STAGES)}; \"\" = off)")
+    parser.add_argument('--min-confidence', type=float, default=0,
+                        help="Read word confidences (0-100) and accept a timestamp straight away only above this; "
+                             "weaker reads try the fallbacks and are flagged for review (0 = off)")
+    parser.add_argument('--ocr-cache', default="ocr_cache.sqlite",
+                        help="SQLite file with the OCR text of every crop already read (\"\" = off)")
+    parser.add_argument('--ocr-cache-size', type=int, default=1_000_000,
+                        help="Crops kept in the OCR cache before the least recently used are evicted")
+    parser.add_argument('--layout-cache', default="layout_cache.json",
+                        help="File with the crop boxes and orientation profiles learned per image layout")
+    parser.add_argument('--journal', default="ocr-journal.jsonl",
+                        help="Append-only log of the results, used to resume an interrupted run")
+    parser.add_argument('--checkpoint-every', type=int, default=100,
+                        help="Images between flushes of the journal to disk")
+    parser.add_argument('--metrics', default="ocr-metrics.jsonl",
+                        help="Sidecar file with per-image stage timings and the winning strategy (\"\" = off)")
+    parser.add_argument('--full-decode', action='store_true',
+                        help="Always decode whole images instead of only the rows of the initial crop box")
+    parser.add_argument('--rescue', action='store_true',
+                        help="Only re-OCR the rows earlier runs left as NF, escalating through quarter turns, wider "
+                             "boxes, preprocessing and other --psm modes until one reads a timestamp")
+    parser.add_argument('--queue', default="",
+                        help="SQLite work queue on storage shared by several nodes; every node runs ocr-time.py "
+                             "with it and leases batches of images from it (\"\" = off)")
+    parser.add_argument('--lease-size', type=int, default=200, help="Images leased from the work queue at a time")
+    parser.add_argument('--lease-seconds', type=float, default=300,
+                        help="Seconds a lease lasts without a heartbeat before its images go to another node")
+    parser.add_argument('--collect', action='store_true',
+                        help="With --queue, only merge the results committed to the queue into the output CSV")
+    args = parser.parse_args()
+    if args.montage < 0:
+        raise SystemExit(f"--montage must be 0 or a number of images, not {args.montage}")
+    if not args.collect:
+        try:
+            check_backend(args.backend, args.tesseract_config)
+        except (RuntimeError, OSError) as e:
+            raise SystemExit(f"Cannot start the {args.backend} OCR engine: {e}")
+
+    # Input and output CSV files
+    input_csv = args.csv
+    output_csv = args.output
+
+    # Image directory
+    image_dir = "downloaded_images"
+
+    # Read all existing data from the output CSV if it exists, then join in the new input rows
+    existing_data = read_results(output_csv)
+    earlier = set(existing_data)
+    new_rows = join_input(input_csv, existing_data)
+    print(f"{new_rows} new URLs in {input_csv}")
+
+    queue = WorkQueue(args.queue, lease_seconds=args.lease_seconds) if args.queue else None
+    if queue and args.collect:
+        committed = queue.results()
+        for url, entry in committed.items():
+            existing_data.setdefault(url, {'URL': url}).update(entry)
+        write_csv(output_csv, list(existing_data.values()))
+        counts = queue.counts()
+        print(f"{len(committed)} results merged from {args.queue}; "
+              + ", ".join(f"{state}: {counts[state]}" for state in ('pending', 'leased', 'failed')))
+        print("Results written to", output_csv)
+        raise SystemExit
+
+    # Results of an interrupted run are applied first and not OCR'ed again
+    # With a work queue, the queue itself keeps the results and the journal is not used
+    journaled = replay_journal(args.journal) if not queue else {}
+    for url, entry in journaled.items():
+        if url in existing_data:
+            existing_data[url].update(entry)
+    if journaled:
+        print(f"Resuming: {len(journaled)} results recovered from {args.journal}")
+
+    # Collect the rows that still need OCR
+    pending_rows = [row for url, row in existing_data.items() if row['timestamp'] == "NF" and url not in journaled]
+    if args.rescue:
+        # New URLs have not had a normal pass yet; most of them do not need the costly tiers
+        pending_rows = [row for row in pending_rows if row['URL'] in earlier]
+    print(f"Skipping {len(existing_data) - len(pending_rows)} already processed files, {len(pending_rows)} to OCR")
+    image_paths = [os.path.join(image_dir, extract_filename(row['URL'])) for row in pending_rows]
+
+    if queue:
+        print(f"{queue.add(row['URL'] for row in pending_rows)} URLs added to the work queue {args.queue}")
+
+    # Process images and update existing data; imap hands results back in input order
+    # Every worker loads its OCR engine once, up front
+    init_ocr = partial(configure_ocr, backend=args.backend, config=args.tesseract_config,
+                       save_rotated=args.save_rotated, band_decode=not args.full_decode,
+                       layout_cache_path=args.layout_cache, preprocess=args.preprocess,
+                       ocr_cache_path=args.ocr_cache, ocr_cache_size=args.ocr_cache_size,
+                       min_confidence=args.min_confidence, glyph_bank_path=args.glyph_bank,
+                       speculative=args.speculative)
+    if args.workers > 1:
+        limit_engine_threads()
+    pool = Pool(args.workers, initializer=init_ocr) if args.workers > 1 else None
+    if not pool:
+        init_ocr()
+    if args.rescue:
+        run = partial(dispatch, pool, chunksize=args.chunksize, task=rescue_task, initial_box=args.initial_box)
+    else:
+        run = partial(dispatch, pool, montage=args.montage, chunksize=args.chunksize, initial_box=args.initial_box)
+    if queue:
+        results = leased_results(queue, existing_data, run, args.lease_size, image_dir)
+    else:
+        results = zip(pending_rows, run(image_paths))
+
+    layout_cache = load_layout_cache(args.layout_cache)
+    rows_decoded = rows_total = 0
+    rescued = Counter()
+    tiers = Counter()
+    review = 0
+    journal = None
+    if not queue:
+        # Appending to a cut-off line would glue the first new entry onto it and lose both
+        trim_journal(args.journal)
+        journal = open(args.journal, 'a', encoding='utf-8')
+    metrics = MetricsLog(args.metrics)
+    try:
+        for done, (row, result) in enumerate(results, 1):
+            filename = extract_filename(row['URL'])
+            if result['rotation']:
+                print(f"Image was rotated: {filename}")
+            row['timestamp'] = result['timestamp']
+            entry = {'URL': row['URL'], 'timestamp': result['timestamp']}
+            if args.min_confidence:
+                confidence = result['confidence']
+                row['confidence'] = entry['confidence'] = "" if confidence is None else f"{confidence:.0f}"
+                review += result['review']
+            print(f"Processed: {filename}, Timestamp: {result['timestamp']}"
+                  + (" (low confidence, needs review)" if result['review'] else ""))
+            rows_decoded += result['rows_decoded']
+            rows_total += result['rows_total']
+            if result['preprocess']:
+                # The stage whose rung found the timestamp rescued the image from the fallbacks
+                rescued[result['preprocess'][-1]] += 1
+            if result['tier']:
+                tiers[result['tier']] += 1
+            learn_from_result(layout_cache, result)
+            metrics.record(row['URL'], result)
+            if not journal:
+                continue
+            journal.write(json.dumps(entry) + '\n')
+            if done % args.checkpoint_every == 0:
+                journal.flush()
+                os.fsync(journal.fileno())
+        if pool:
+            # Workers that exit on their own write the OCR cache hits they batched; terminate() would drop them
+            pool.close()
+            pool.join()
+    finally:
+        if pool:
+            pool.terminate()
+        close_ocr_cache()
+        if journal:
+            journal.close()
+        metrics.close()
+        save_layout_cache(args.layout_cache, layout_cache)
+
+    if queue:
+        # Results of every node are in the queue; one --collect run writes them to the CSV
+        counts = queue.counts()
+        print(f"Work queue: done: {counts['done']}, failed: {counts['failed']}; "
+              f"run with --collect to write the results to {output_csv}")
     else:
-        timestamp = "NF"
-    
-    row['timestamp'] = timestamp
-    print(f"Processed: {filename}, Timestamp: {timestamp}")
-
-# Write the updated data back to the output CSV
-with open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
-    fieldnames = list(next(iter(existing_data.values())).keys()) if existing_data else ['URL', 'timestamp']
-    writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-    writer.writeheader()
-    writer.writerows(existing_data.values())
-
-print("Processing complete. Results written to", output_csv)
+        # Compact the journal into the output CSV; it is only removed once the CSV is safely in place
+        write_csv(output_csv, list(existing_data.values()))
+        os.remove(args.journal)
+
+    for line in metrics.summary():
+        print(line)
+    if args.min_confidence:
+        print(f"{review} timestamps read below confidence {args.min_confidence:g}; "
+              "review the rows with a low confidence in validate-ocr.py")
+    if rows_total:
+        print(f"Decoded {rows_decoded / rows_total:.0%} of the image rows a full decode of every image would need")
+    if args.rescue:
+        print(f"NF images read again: {sum(tiers.values())} of {len(pending_rows)}"
+              + "".join(f", {tier}: {count}" for tier, count in tiers.most_common()))
+    if args.preprocess:
+        print("Images rescued by preprocessing: "
+              + ", ".join(f"{stage}: {rescued[stage]}" for stage in args.preprocess))
+    if not queue:
+        print("Processing complete. Results written to", output_csv)
@@ -0,0 +1,86 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+class OcrCache:
+    """OCR text of every crop already read, kept in SQLite and shared by ocr-time.py and validate-ocr.py.
+
+    Entries are keyed by cache_key(); once there are more than `max_entries`, the least
+    recently used ones are evicted. Hits are read-only: their last use is only refreshed
+    once it is older than `touch_after` seconds, and then in batches of `touch_every`.
+    """
+
+    def __init__(self, path, max_entries=1_000_000, evict_every=1000, touch_after=3600, touch_every=1000):
+        # Speculative OCR threads share the connection, one statement at a time
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS ocr_used ON ocr (used)')
+        self.db.commit()
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.touch_after = touch_after
+        self.touch_every = touch_every
+        self.touched = set()
+        self.puts = 0
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT text, used FROM ocr WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            text, used = row
+            # A write per hit would make every worker queue on SQLite's single writer lock
+            if used < time.time() - self.touch_after:
+                self.touched.add(key)
+        if len(self.touched) >= self.touch_every:
+            self.touch()
+        return text
+
+    def touch(self):
+        """Write the last use of the hits since the previous touch."""
+        with self.lock:
+            if self.touched:
+                now = time.time()
+                self.db.executemany('UPDATE ocr SET used = ? WHERE key = ?', ((now, key) for key in self.touched))
+                self.db.commit()
+                self.touched.clear()
+
+    def put(self, key, text):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO ocr (key, text, used) VALUES (?, ?, ?)', (key, text, time.time()))
+            self.db.commit()
+            self.puts += 1
+        # Counting the rows is a table scan, so the bound is only enforced every few puts
+        if self.puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        # Entries in use must not look older than they are
+        self.touch()
+        with self.lock:
+            excess = self.db.execute('SELECT COUNT(*) FROM ocr').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.db.execute('DELETE FROM ocr WHERE key IN (SELECT key FROM ocr ORDER BY used LIMIT ?)', (excess,))
+                self.db.commit()
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+
+def hash_image(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(image_hash, box, rotation, preprocess, engine):
+    """Everything that changes the OCR text of a crop: the image, the box, the rotation,
+    the preprocessing stages and the OCR engine with its config."""
+    return '|'.join([image_hash, ','.join(map(str, box)), str(rotation), ','.join(preprocess), engine])
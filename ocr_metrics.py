@@ -0,0 +1,73 @@
+import json
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# Stages timed by timestamp_ocr.ocr_file, in pipeline order
+STAGES = ('read', 'decode', 'cache', 'orientation', 'rotate', 'crop', 'templates', 'montage', 'preprocess',
+          'tesseract', 'localize')
+
+# Upper bounds (ms) of the histogram buckets; the last bucket is open-ended
+BUCKETS = (1, 3, 10, 30, 100, 300, 1000)
+
+
+class MetricsLog:
+    """Per-image OCR timings and winning strategy, appended to a JSON Lines sidecar file
+    and summarized as stage histograms and strategy hit rates at the end of a run."""
+
+    def __init__(self, path=None):
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+        self.timings = defaultdict(list)
+        self.strategies = Counter()
+        self.strategy_calls = Counter()
+        self.strategy_ms = Counter()
+        self.images = 0
+
+    def record(self, url, result):
+        timings = result['timings']
+        total = sum(timings.values())
+        strategy = result['strategy'] or 'not found'
+        if result['reader'] and result['reader'] != 'tesseract':
+            strategy += f" ({result['reader']})"
+        if self.file:
+            self.file.write(json.dumps({'URL': url, 'timestamp': result['timestamp'], 'strategy': result['strategy'],
+                                        'rotation': result['rotation'], 'box': result['box'],
+                                        'preprocess': result['preprocess'], 'confidence': result['confidence'],
+                                        'reader': result['reader'], 'tier': result['tier'],
+                                        'ocr_calls': result['ocr_calls'],
+                                        'total_ms': round(total, 2), 'timings': timings}) + '\n')
+        self.images += 1
+        for stage in STAGES:
+            self.timings[stage].append(timings.get(stage, 0.0))
+        self.timings['total'].append(total)
+        self.strategies[strategy] += 1
+        self.strategy_calls[strategy] += result['ocr_calls']
+        self.strategy_ms[strategy] += total
+
+    def summary(self):
+        if not self.images:
+            return []
+        grand_total = sum(self.timings['total']) or 1.0
+        bucket_labels = [f"<{bound}" for bound in BUCKETS] + [f">={BUCKETS[-1]}"]
+        lines = [f"{'stage':<12} {'total s':>9} {'share':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}  "
+                 + ' '.join(f"{label:>6}" for label in bucket_labels)]
+        for stage in STAGES + ('total',):
+            values = np.array(self.timings[stage])
+            if not values.any():
+                continue
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            # Images that never ran a stage are left out of its histogram
+            histogram = np.bincount(np.searchsorted(BUCKETS, values[values > 0], side='right'),
+                                    minlength=len(BUCKETS) + 1)
+            lines.append(f"{stage:<12} {values.sum() / 1000:>9.1f} {values.sum() / grand_total:>6.0%} "
+                         f"{p50:>8.1f} {p90:>8.1f} {p99:>8.1f}  " + ' '.join(f"{count:>6}" for count in histogram))
+        lines.append("")
+        lines.append(f"{'strategy':<20} {'images':>7} {'share':>6} {'OCR calls':>10} {'ms/image':>9}")
+        for strategy, count in self.strategies.most_common():
+            lines.append(f"{strategy:<20} {count:>7} {count / self.images:>6.1%} "
+                         f"{self.strategy_calls[strategy] / count:>10.2f} {self.strategy_ms[strategy] / count:>9.1f}")
+        return lines
+
+    def close(self):
+        if self.file:
+            self.file.close()
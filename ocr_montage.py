@@ -0,0 +1,57 @@
+import bisect
+
+import numpy as np
+
+# Tiles the timestamp crops of many images into one image, so Tesseract's fixed cost per
+# call (process start, model load, page layout) is paid once per batch instead of per crop.
+
+# Tesseract (through Leptonica) refuses images with a side longer than this
+MAX_MONTAGE_SIDE = 32767
+
+
+def build_montage(crops, gap=24):
+    """Stack grayscale `crops` top to bottom on a white page, `gap` pixels apart.
+
+    Returns the montage and the (top, bottom) rows of every cell. The gap is wider than the
+    spacing between text lines, so Tesseract never merges lines of neighbouring crops.
+    """
+    width = max((cropped.shape[1] for cropped in crops), default=0) + 2 * gap
+    height = sum(cropped.shape[0] for cropped in crops) + gap * (len(crops) + 1)
+    montage = np.full((height, width), 255, dtype=np.uint8)
+    cells = []
+    top = gap
+    for cropped in crops:
+        bottom = top + cropped.shape[0]
+        if cropped.size:
+            montage[top:bottom, gap:gap + cropped.shape[1]] = cropped
+        cells.append((top, bottom))
+        top = bottom + gap
+    return montage, cells
+
+
+def pack_montages(crops, gap=24, max_height=MAX_MONTAGE_SIDE):
+    """Split `crops` into consecutive runs whose montage stays within `max_height` rows."""
+    groups = []
+    group, height = [], gap
+    for cropped in crops:
+        needed = cropped.shape[0] + gap
+        if group and height + needed > max_height:
+            groups.append(group)
+            group, height = [], gap
+        group.append(cropped)
+        height += needed
+    if group:
+        groups.append(group)
+    return groups
+
+
+def assign_words(words, cells):
+    """Group (word, confidence, left, top, right, bottom) boxes by the cell holding their centre."""
+    tops = [top for top, _ in cells]
+    cell_words = [[] for _ in cells]
+    for word, confidence, left, top, right, bottom in words:
+        centre = (top + bottom) / 2
+        index = bisect.bisect_right(tops, centre) - 1
+        if index >= 0 and centre <= cells[index][1]:
+            cell_words[index].append((word, confidence))
+    return cell_words
@@ -0,0 +1,924 @@
+import io
+import json
+import os
+import re
+import shlex
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from multiprocessing import util
+from urllib.parse import urlparse
+import cv2
+import numpy as np
+from PIL import Image
+import pytesseract
+
+from digit_templates import GlyphBank
+from ocr_cache import OcrCache, cache_key, hash_image
+from ocr_montage import assign_words, build_montage, pack_montages
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Set the path to the Tesseract executable if it's not in your PATH
+pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+# Define the initial crop box
+INITIAL_CROP_BOX = (300, 400, 650, 600)
+
+TIME_PATTERN = re.compile(r'\b([01]\d|2[0-3]):([0-5]\d)(:([0-5]\d))?\b')
+
+# Orientation is judged from ink profiles of the scan shrunk to this size (width, height)
+PROFILE_SIZE = (32, 96)
+
+# Extra rows decoded below a band: the last row of a truncated decode lacks the
+# chroma of the row under it, and one 4:2:0 MCU row is 16 pixels high
+JPEG_ROW_MARGIN = 16
+
+# Preprocessing ladder tried on the first tight box when the raw crop yields nothing;
+# each rung adds the next stage to the previous rung's array
+DEFAULT_PREPROCESS = ('gray', 'upscale', 'threshold', 'denoise', 'deskew')
+
+# Page segmentation mode the montage is read with whatever the crops use: a single-line
+# mode would read the stacked crops as one line
+MONTAGE_PSM = 6
+
+# Page segmentation modes of the last rescue tiers: a uniform block, sparse text, a single line
+RESCUE_PSM = (6, 11, 7)
+
+class PytesseractBackend:
+    """Runs the tesseract executable for every call (temp image file, model load, stdout parsing)."""
+
+    name = 'pytesseract'
+
+    def __init__(self, config=''):
+        self.config = config
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, config=self.config)
+
+    def image_to_words(self, image):
+        data = pytesseract.image_to_data(image, config=self.config, output_type=pytesseract.Output.DICT)
+        return [(word, float(conf)) for word, conf in zip(data['text'], data['conf']) if word.strip()]
+
+    def image_to_word_boxes(self, image):
+        """(word, confidence, left, top, right, bottom) for every word in the image."""
+        data = pytesseract.image_to_data(image, config=self.config, output_type=pytesseract.Output.DICT)
+        return [(word, float(conf), left, top, left + width, top + height)
+                for word, conf, left, top, width, height
+                in zip(data['text'], data['conf'], data['left'], data['top'], data['width'], data['height'])
+                if word.strip()]
+
+class TesserocrBackend:
+    """Keeps one Tesseract engine loaded through the C API and passes crops to it in memory."""
+
+    name = 'tesserocr'
+
+    def __init__(self, config='', lang='eng'):
+        if tesserocr is None:
+            raise RuntimeError("The tesserocr backend needs the tesserocr package (pip install tesserocr)")
+        psm, variables = parse_tesseract_config(config)
+        self.config = config
+        kwargs = {'lang': lang}
+        # Reuse the language data of the tesseract install configured above
+        tessdata = os.path.join(os.path.dirname(pytesseract.pytesseract.tesseract_cmd), 'tessdata')
+        if os.path.isdir(tessdata):
+            kwargs['path'] = tessdata
+        if psm is not None:
+            kwargs['psm'] = psm
+        self.api = tesserocr.PyTessBaseAPI(**kwargs)
+        for key, value in variables.items():
+            self.api.SetVariable(key, value)
+
+    def image_to_string(self, image):
+        self.api.SetImage(Image.fromarray(image) if isinstance(image, np.ndarray) else image)
+        return self.api.GetUTF8Text()
+
+    def image_to_words(self, image):
+        self.api.SetImage(Image.fromarray(image) if isinstance(image, np.ndarray) else image)
+        return [(word, float(conf)) for word, conf in self.api.MapWordConfidences() if word.strip()]
+
+    def image_to_word_boxes(self, image):
+        self.api.SetImage(Image.fromarray(image) if isinstance(image, np.ndarray) else image)
+        self.api.Recognize()
+        words = []
+        level = tesserocr.RIL.WORD
+        for word in tesserocr.iterate_level(self.api.GetIterator(), level):
+            text = word.GetUTF8Text(level)
+            if text and text.strip():
+                words.append((text, float(word.Confidence(level)), *word.BoundingBox(level)))
+        return words
+
+BACKENDS = {backend.name: backend for backend in (PytesseractBackend, TesserocrBackend)}
+
+# One engine per process, created by configure_ocr (the Pool initializer in the scripts)
+_backend = None
+# Speculative threads get engines of their own; one engine cannot run two recognitions at once
+_thread_backends = threading.local()
+# Engines with other tesseract options, created on demand by the rescue tiers
+_config_backends = {}
+_speculator = None
+_save_rotated = False
+_band_decode = True
+_preprocess = DEFAULT_PREPROCESS
+_ocr_cache = None
+_min_confidence = 0
+_glyph_bank = None
+_layout_cache = {'boxes': {}, 'profiles': {}}
+
+def parse_tesseract_config(config):
+    """Split a tesseract command-line config ("--psm 7 -c key=value") into psm and variables."""
+    psm = None
+    variables = {}
+    args = shlex.split(config)
+    for option, value in zip(args, args[1:]):
+        if option == '--psm':
+            psm = int(value)
+        elif option == '-c':
+            key, _, variable = value.partition('=')
+            variables[key] = variable
+    return psm, variables
+
+def configure_ocr(backend='pytesseract', config='', save_rotated=False, band_decode=True, layout_cache_path=None,
+                  preprocess=DEFAULT_PREPROCESS, ocr_cache_path=None, ocr_cache_size=1_000_000, min_confidence=0,
+                  glyph_bank_path=None, speculative=0):
+    global _backend, _save_rotated, _band_decode, _preprocess, _ocr_cache, _min_confidence, _glyph_bank
+    global _speculator, _layout_cache
+    _backend = BACKENDS[backend](config)
+    _thread_backends.__dict__.clear()
+    _config_backends.clear()
+    # Threads that run the fallback strategies of a hard image side by side (0 = one after another)
+    _speculator = ThreadPoolExecutor(speculative, thread_name_prefix='speculative') if speculative > 1 else None
+    _save_rotated = save_rotated
+    _band_decode = band_decode
+    _preprocess = tuple(preprocess)
+    close_ocr_cache()
+    _ocr_cache = OcrCache(ocr_cache_path, ocr_cache_size) if ocr_cache_path else None
+    if _ocr_cache:
+        # Pool workers skip atexit; a finalizer still runs when they exit normally (not on terminate())
+        util.Finalize(None, close_ocr_cache, exitpriority=10)
+    # Above 0, words are read with their confidences and weaker reads escalate to the fallbacks
+    _min_confidence = min_confidence
+    # Without a bank (build-glyph-bank.py writes it) every crop goes to Tesseract
+    _glyph_bank = GlyphBank.load(glyph_bank_path) if glyph_bank_path and os.path.exists(glyph_bank_path) else None
+    # Each worker starts from the boxes and profiles learned by previous runs and keeps learning
+    _layout_cache = load_layout_cache(layout_cache_path)
+
+def close_ocr_cache():
+    """Write the hits batched by this process's OCR cache, enforce its size bound and close it."""
+    global _ocr_cache
+    if _ocr_cache:
+        _ocr_cache.close()
+        _ocr_cache = None
+
+def check_backend(backend='pytesseract', config=''):
+    """Start the OCR engine once in this process; raises if it is missing.
+
+    A Pool whose initializer fails keeps restarting its workers forever, so the scripts
+    call this before starting one.
+    """
+    engine = BACKENDS[backend](config)
+    if isinstance(engine, PytesseractBackend):
+        pytesseract.get_tesseract_version()
+
+def limit_engine_threads():
+    """Run Tesseract single-threaded when there is already one OCR process per core.
+
+    Its OpenMP threads would otherwise oversubscribe the CPU; Tesseract recommends this
+    whenever several instances run at once. It takes effect for the tesseract processes
+    pytesseract starts; libtesseract (tesserocr) reads it when loaded, so for that backend
+    it has to be set in the shell. An explicit setting wins.
+    """
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+def get_backend():
+    if _backend is None:
+        configure_ocr()
+    if threading.current_thread() is threading.main_thread():
+        return _backend
+    backend = getattr(_thread_backends, 'backend', None)
+    if backend is None:
+        backend = _thread_backends.backend = BACKENDS[_backend.name](_backend.config)
+    return backend
+
+@contextmanager
+def tesseract_config(config):
+    """Read with other tesseract options inside the block (None = unchanged); main thread only."""
+    global _backend
+    backend = get_backend()
+    if config is not None:
+        if config not in _config_backends:
+            _config_backends[config] = BACKENDS[backend.name](config)
+        _backend = _config_backends[config]
+    try:
+        yield
+    finally:
+        _backend = backend
+
+def with_psm(config, psm):
+    return ' '.join(re.sub(r'--psm\s+\d+', '', config).split() + ['--psm', str(psm)])
+
+def engine_name(backend, words=False):
+    # Part of the OCR cache key: other engines or options may read a crop differently
+    return f"{backend.name} {backend.config}{' +words' if words else ''}".strip()
+
+def parse_timestamp(text):
+    match = TIME_PATTERN.search(text)
+    if not match:
+        return "NF"
+    return ':'.join(part for part in match.group(1, 2, 4) if part)
+
+def parse_timestamp_words(words):
+    """Timestamp in OCR'ed (word, confidence) pairs and the lowest confidence among the words it spans."""
+    text = ""
+    spans = []
+    for word, confidence in words:
+        start = len(text) + 1 if text else 0
+        text = f"{text} {word}" if text else word
+        spans.append((start, len(text), confidence))
+    match = TIME_PATTERN.search(text)
+    if not match:
+        return "NF", None
+    confidence = min(conf for start, end, conf in spans if start < match.end() and end > match.start())
+    return parse_timestamp(text), confidence
+
+def unreadable_image(error):
+    """Whether `error` comes from a truncated or garbage image file rather than from the OCR engine."""
+    return isinstance(error, OSError) and not isinstance(error, pytesseract.TesseractNotFoundError)
+
+def load_image(source):
+    # Decode into an RGB array; crops and rotations below are views of it
+    with Image.open(source) as img:
+        return np.asarray(img.convert('RGB'))
+
+def find_jpeg_frame(data):
+    """Offset of the height field, height and width of a baseline JPEG, or None for anything else."""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker in (0xC0, 0xC1):  # Baseline / extended sequential frame
+            return i + 5, int.from_bytes(data[i + 5:i + 7], 'big'), int.from_bytes(data[i + 7:i + 9], 'big')
+        if marker == 0xDA or 0xC2 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return None  # Progressive or lossless frames must be decoded in full
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+def decode_rows(data, frame, rows):
+    """Decode only the top `rows` rows of a baseline JPEG, or None if that is not possible.
+
+    Lowering the height in the frame header makes libjpeg stop after the band, so the
+    rest of the image is never IDCT'ed or colour-converted.
+    """
+    offset, height, width = frame
+    if rows + JPEG_ROW_MARGIN >= height:
+        return None
+    patched = bytearray(data)
+    patched[offset:offset + 2] = (rows + JPEG_ROW_MARGIN).to_bytes(2, 'big')
+    try:
+        return load_image(io.BytesIO(patched))[:rows]
+    except OSError:
+        return None
+
+class TallyImage:
+    """An encoded image that decodes no more rows than the OCR passes so far have needed."""
+
+    def __init__(self, data, band_decode=True):
+        self.data = data
+        self.frame = find_jpeg_frame(data) if band_decode else None
+        if self.frame:
+            _, self.height, self.width = self.frame
+        else:
+            with Image.open(io.BytesIO(data)) as img:
+                self.width, self.height = img.size
+        self.array = None
+        self.rows_decoded = 0
+
+    def rows(self, rows):
+        """An array holding at least the top `rows` rows (the whole image if it is cheaper)."""
+        rows = min(rows, self.height)
+        if self.array is not None and self.array.shape[0] >= rows:
+            return self.array
+        band = decode_rows(self.data, self.frame, rows) if self.frame else None
+        self.array = band if band is not None else load_image(io.BytesIO(self.data))
+        self.rows_decoded += self.array.shape[0]
+        return self.array
+
+    def full(self):
+        return self.rows(self.height)
+
+def crop(image, box):
+    left, top, right, bottom = box
+    return image[max(top, 0):bottom, max(left, 0):right]
+
+def rotate(image, angle):
+    # Counter-clockwise, like PIL's Image.rotate
+    return np.rot90(image, angle // 90)
+
+def to_gray(image):
+    # Grayscale with the contrast stretched to the full range, which lifts faded thermal prints
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    return cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
+
+def upscale(image, factor=2):
+    # Tesseract reads best with characters around 30 pixels high
+    return cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC)
+
+def adaptive_threshold(image, block_size=31, offset=10):
+    # A local threshold copes with uneven fading and shadows across the crop
+    return cv2.adaptiveThreshold(to_gray(image), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                 block_size, offset)
+
+def denoise(image):
+    # A median filter removes speckle without rounding the strokes off
+    return cv2.medianBlur(to_gray(image), 3)
+
+def deskew(image, max_angle=5, step=0.5):
+    """Rotate the crop so its text lines are level; the skew is where the row profile peaks most."""
+    gray = to_gray(image)
+    ys, xs = np.nonzero(gray < 128)
+    if len(ys) < 2:
+        return gray
+    angles = np.arange(-max_angle, max_angle + step, step)
+    scores = []
+    for angle in angles:
+        lines = np.round(ys - xs * np.tan(np.radians(angle))).astype(int)
+        scores.append((np.bincount(lines - lines.min()).astype(float) ** 2).sum())
+    angle = float(angles[int(np.argmax(scores))])
+    if angle == 0:
+        return gray
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1)
+    return cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=255)
+
+PREPROCESS_STAGES = {'gray': to_gray, 'upscale': upscale, 'threshold': adaptive_threshold,
+                     'denoise': denoise, 'deskew': deskew}
+
+def parse_stages(text):
+    """Comma-separated stage names (as given on the command line) as a tuple."""
+    stages = tuple(stage.strip() for stage in text.split(',') if stage.strip())
+    unknown = [stage for stage in stages if stage not in PREPROCESS_STAGES]
+    if unknown:
+        raise ValueError(f"unknown preprocessing stage(s): {', '.join(unknown)}")
+    return stages
+
+def parse_box(text):
+    """A crop box given on the command line as left:top:right:bottom, as a tuple."""
+    box = tuple(int(value) for value in text.split(':'))
+    if len(box) != 4 or box[0] >= box[2] or box[1] >= box[3]:
+        raise ValueError(f"not a left:top:right:bottom box: {text}")
+    return box
+
+def preprocess(image, stages):
+    for stage in stages:
+        image = PREPROCESS_STAGES[stage](image)
+    return image
+
+def read_text(image):
+    if image.size == 0:
+        return ""
+    return get_backend().image_to_string(image)
+
+def read_words(image):
+    if image.size == 0:
+        return []
+    return get_backend().image_to_words(image)
+
+def read_timestamp(image):
+    return parse_timestamp(read_text(image))
+
+def extract_timestamp(image, box, stages=()):
+    return read_timestamp(preprocess(crop(image, box), stages))
+
+def extract_filename(url):
+    return os.path.basename(urlparse(url).path)
+
+def localize_boxes(image, box_size, count=2, exclude=(), step=8):
+    """Windows of `box_size` with the densest text strokes in `image`, best first.
+
+    Printed characters produce strong horizontal intensity changes, so the number of
+    strong gradients inside a window is a cheap stand-in for "there is text here".
+    Windows overlapping a box in `exclude` (already tried) are skipped.
+    """
+    box_width, box_height = box_size[0] // 2, box_size[1] // 2
+    # Half resolution is plenty to score windows this large
+    gray = image[::2, ::2].mean(axis=2) if image.ndim == 3 else image[::2, ::2].astype(float)
+    height, width = gray.shape
+    if box_width >= width or box_height >= height:
+        return []
+    edges = np.abs(np.diff(gray, axis=1)) > 40
+    integral = np.zeros((height + 1, width), dtype=np.int32)
+    integral[1:, 1:] = edges.cumsum(axis=0).cumsum(axis=1)
+
+    ys = np.arange(0, height - box_height + 1, step // 2)[:, None]
+    xs = np.arange(0, width - box_width, step // 2)[None, :]
+    scores = (integral[ys + box_height, xs + box_width] - integral[ys, xs + box_width]
+              - integral[ys + box_height, xs] + integral[ys, xs])
+
+    boxes = []
+    for index in np.argsort(scores, axis=None)[::-1]:
+        if len(boxes) == count or scores.flat[index] == 0:
+            break
+        y, x = np.unravel_index(index, scores.shape)
+        box = (int(xs[0, x]) * 2, int(ys[y, 0]) * 2, int(xs[0, x] + box_width) * 2, int(ys[y, 0] + box_height) * 2)
+        if all(overlap(box, other) < 0.5 for other in list(exclude) + boxes):
+            boxes.append(box)
+    return boxes
+
+def overlap(box, other):
+    """Intersection over union of two (left, top, right, bottom) boxes."""
+    width = min(box[2], other[2]) - max(box[0], other[0])
+    height = min(box[3], other[3]) - max(box[1], other[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area = (box[2] - box[0]) * (box[3] - box[1]) + (other[2] - other[0]) * (other[3] - other[1])
+    return intersection / (area - intersection)
+
+def layout_key(width, height):
+    # Scans of the same size come from the same printer/scanner layout
+    return f"{width}x{height}"
+
+def learn_box(boxes, layout, box, keep=4):
+    """Count a hit for `box` in the layout's learned boxes; near-duplicates share one entry."""
+    entries = boxes.setdefault(layout, [])
+    for entry in entries:
+        if overlap(box, entry['box']) >= 0.5:
+            entry['hits'] += 1
+            break
+    else:
+        entries.append({'box': list(box), 'hits': 1})
+    entries.sort(key=lambda entry: -entry['hits'])
+    del entries[keep:]
+
+def learn_profile(profiles, layout, profile, max_count=500):
+    # Running mean of the upright profiles; capping the count keeps it adapting
+    entry = profiles.setdefault(layout, {'profile': [0.0] * len(profile), 'count': 0})
+    count = min(entry['count'], max_count - 1)
+    entry['profile'] = [(old * count + new) / (count + 1) for old, new in zip(entry['profile'], profile)]
+    entry['count'] = count + 1
+
+def learn_from_result(layout_cache, result):
+    if result['timestamp'] == "NF" or result['review']:
+        return
+    # Only tight boxes are worth trying first next time
+    if result['strategy'] in ('learned box', 'initial box', 'localized box'):
+        learn_box(layout_cache['boxes'], result['layout'], tuple(result['box']))
+    if result['profile']:
+        learn_profile(layout_cache['profiles'], result['layout'], result['profile'])
+
+def load_layout_cache(path):
+    if not path or not os.path.exists(path):
+        return {'boxes': {}, 'profiles': {}}
+    with open(path, 'r', encoding='utf-8') as cache_file:
+        return json.load(cache_file)
+
+def save_layout_cache(path, layout_cache):
+    # Nodes sharing a work queue may save to the same path at once, so each writes its own temporary file
+    tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+        json.dump(layout_cache, cache_file)
+    os.replace(tmp_path, path)
+
+def decode_thumbnail(data):
+    """Grayscale scan at about 1/8 scale; JPEG DCT scaling makes this far cheaper than a full decode."""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft('L', (img.width // 8, img.height // 8))
+        return np.asarray(img.convert('L'))
+
+def ink_profile(thumbnail):
+    """Row and column ink profiles of an upright thumbnail, normalized to zero mean and unit variance."""
+    ink = 255 - np.asarray(Image.fromarray(thumbnail).resize(PROFILE_SIZE, Image.BILINEAR), dtype=float)
+    profile = np.concatenate([ink.mean(axis=1), ink.mean(axis=0)])
+    spread = profile.std()
+    return (profile - profile.mean()) / spread if spread else np.zeros_like(profile)
+
+def detect_orientation(thumbnail, width, height, profiles, margin=0.1):
+    """Counter-clockwise rotation (0, 90, 180 or 270) that makes the scan upright.
+
+    Tallies of one layout share a fixed form, so the scan's ink profile in each of the
+    four orientations is correlated with the upright profile learned for that layout.
+    Without a learned profile, text lines only tell whether the scan is sideways.
+    """
+    scores = {}
+    for angle in (0, 90, 180, 270):
+        upright = (width, height) if angle in (0, 180) else (height, width)
+        template = profiles.get(layout_key(*upright))
+        if template:
+            scores[angle] = float(np.mean(ink_profile(np.rot90(thumbnail, angle // 90)) * template['profile']))
+    if scores:
+        best = max(scores, key=scores.get)
+        if best == 0 or scores[best] - scores.get(0, -1.0) < margin:
+            return 0
+        return best
+
+    # Text lines make the row profile alternate between ink and gaps; sideways, the columns do.
+    # Smoothing over a few pixels blurs the gaps between characters but not between lines.
+    ink = np.clip(200 - thumbnail.astype(float), 0, None)
+    row_changes = profile_changes(ink.mean(axis=1))
+    column_changes = profile_changes(ink.mean(axis=0))
+    return 90 if column_changes > 1.2 * row_changes else 0
+
+def profile_changes(profile, window=4):
+    smooth = np.convolve(profile, np.ones(window) / window, mode='valid')
+    return np.abs(np.diff(smooth)).mean() / (smooth.mean() + 1e-9)
+
+class StageTimer:
+    """Time spent and calls made in each stage (decode, crop, tesseract...) of one image's OCR."""
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.seconds[name] += time.perf_counter() - start
+                self.calls[name] += 1
+
+    def milliseconds(self):
+        return {name: round(seconds * 1000, 2) for name, seconds in self.seconds.items()}
+
+def ocr_crop(image):
+    # What the OCR cache stores: the text, or the words with their confidences as JSON
+    if _min_confidence:
+        return json.dumps(read_words(image))
+    return read_text(image)
+
+def read_templates(image):
+    """A crop's timestamp read by the glyph templates, in ocr_crop() format, or None if they reject it."""
+    if _glyph_bank is None or image.size == 0:
+        return None
+    timestamp, confidence = _glyph_bank.read(image, TIME_PATTERN)
+    if timestamp is None:
+        return None
+    return json.dumps([(timestamp, confidence)]) if _min_confidence else timestamp
+
+def parse_ocr(text):
+    """Timestamp and confidence (None outside the confidence mode) of an ocr_crop() output."""
+    if _min_confidence:
+        return parse_timestamp_words(json.loads(text))
+    return parse_timestamp(text), None
+
+def settled(found):
+    # A read is final once it is confident enough (any read is, outside the confidence mode)
+    timestamp, strategy, confidence, reader = found
+    return strategy is not None and (confidence is None or confidence >= _min_confidence)
+
+def process_image(load, strategies, image_hash=None, timer=None, found=("NF", None, None, None), known=None):
+    """Try `strategies` in order and return (timestamp, strategy, confidence, reader) of the first settled read.
+
+    Without one, the most confident read so far (starting from `found`) is returned, so the
+    caller can escalate to further strategies. `known` maps (angle, box, stages) to an OCR
+    output and its reader for crops read elsewhere. `load` returns the decoded image; it is
+    only called once a crop is missing from `known` and the OCR cache, so images whose crops
+    were all read before are never decoded.
+    """
+    timer = timer or StageTimer()
+    rotations = {}
+    crops = {}
+    for strategy in strategies:
+        name, angle, box, stages = strategy
+        engine = engine_name(get_backend(), words=bool(_min_confidence))
+        key = cache_key(image_hash, box, angle, stages, engine) if image_hash else None
+        text, reader = known.get((angle, box, stages), (None, None)) if known else (None, None)
+        if text is None and key and _ocr_cache:
+            with timer.stage('cache'):
+                text, reader = _ocr_cache.get(key), 'tesseract'
+        if text is None:
+            if not rotations:
+                rotations[0] = load()
+            if angle not in rotations:
+                with timer.stage('rotate'):
+                    rotations[angle] = rotate(rotations[0], angle)
+            # A ladder rung only applies its last stage to the array of the rung before it
+            previous = crops.get((angle, box, stages[:-1]))
+            if stages and previous is not None:
+                with timer.stage('preprocess'):
+                    cropped = PREPROCESS_STAGES[stages[-1]](previous)
+            else:
+                with timer.stage('crop'):
+                    cropped = crop(rotations[angle], box)
+                if stages:
+                    with timer.stage('preprocess'):
+                        cropped = preprocess(cropped, stages)
+            crops[angle, box, stages] = cropped
+            # The templates only know the raw print; they are too cheap to be worth caching
+            if not stages and _glyph_bank is not None:
+                with timer.stage('templates'):
+                    text = read_templates(cropped)
+                if text is not None:
+                    timestamp, confidence = parse_ocr(text)
+                    read = (timestamp, strategy, confidence, 'templates')
+                    if settled(read):
+                        return read
+                    if found[1] is None or confidence > found[2]:
+                        found = read
+            with timer.stage('tesseract'):
+                text, reader = ocr_crop(cropped), 'tesseract'
+            if key and _ocr_cache:
+                with timer.stage('cache'):
+                    _ocr_cache.put(key, text)
+        timestamp, confidence = parse_ocr(text)
+        if timestamp == "NF":
+            continue
+        read = (timestamp, strategy, confidence, reader)
+        if settled(read):
+            return read
+        if found[1] is None or confidence > found[2]:
+            found = read
+    return found
+
+def race_strategies(load, strategies, image_hash=None, timer=None, found=("NF", None, None, None)):
+    """Like process_image, but every strategy runs at once on the speculative threads.
+
+    The first settled read wins and the strategies that have not started are cancelled; the
+    ones already in Tesseract finish in the background and their reads are dropped. Without a
+    settled read the most confident one is returned.
+    """
+    image = load()
+    futures = [_speculator.submit(process_image, lambda: image, [strategy], image_hash, timer)
+               for strategy in strategies]
+    try:
+        for future in as_completed(futures):
+            read = future.result()
+            if settled(read):
+                return read
+            if read[1] is not None and (found[1] is None or read[2] > found[2]):
+                found = read
+    finally:
+        for future in futures:
+            future.cancel()
+    return found
+
+def save_rotated_copy(image_path, image, angle):
+    file_name, file_extension = os.path.splitext(image_path)
+    Image.fromarray(rotate(image, angle)).save(f"{file_name}_rotated{file_extension}")
+
+def empty_result(layout=None, rows_total=0):
+    return {'timestamp': "NF", 'strategy': None, 'rotation': 0, 'box': None, 'preprocess': [], 'layout': layout,
+            'profile': None, 'rows_decoded': 0, 'rows_total': rows_total, 'ocr_calls': 0, 'timings': {},
+            'confidence': None, 'review': False, 'reader': None, 'tier': None}
+
+class Scan:
+    """An image file opened for OCR: its bytes, a lazy decoder, its orientation and upright layout."""
+
+    def __init__(self, image_path, timer=None):
+        self.path = image_path
+        self.timer = timer = timer or StageTimer()
+        with timer.stage('read'):
+            with open(image_path, 'rb') as image_file:
+                data = image_file.read()
+        with timer.stage('decode'):
+            self.image = TallyImage(data, _band_decode)
+            self.thumbnail = decode_thumbnail(data)
+        self.image_hash = None
+        if _ocr_cache:
+            with timer.stage('cache'):
+                self.image_hash = hash_image(data)
+
+        # Pick the rotation first, so most scans need a single OCR call whatever their orientation
+        with timer.stage('orientation'):
+            self.angle = detect_orientation(self.thumbnail, self.image.width, self.image.height,
+                                            _layout_cache['profiles'])
+        if self.angle in (0, 180):
+            self.width, self.height = self.image.width, self.image.height
+        else:
+            self.width, self.height = self.image.height, self.image.width
+        self.layout = layout_key(self.width, self.height)
+
+    def rows(self, count):
+        # Upright scans only need their top rows decoded; rotated ones need the whole image
+        with self.timer.stage('decode'):
+            return self.image.rows(count) if self.angle == 0 else self.image.full()
+
+    def tight_strategies(self, initial_box):
+        """Boxes that found the timestamp on earlier images of this layout, then the default box."""
+        tight_boxes = [tuple(entry['box']) for entry in _layout_cache['boxes'].get(self.layout, [])]
+        strategies = [('learned box', self.angle, box, ()) for box in tight_boxes]
+        if all(overlap(initial_box, box) < 0.9 for box in tight_boxes):
+            strategies.append(('initial box', self.angle, initial_box, ()))
+            tight_boxes.append(initial_box)
+        return strategies, tight_boxes
+
+def ocr_file(image_path, initial_box=INITIAL_CROP_BOX, scan=None, known=None):
+    """OCR one image file and return a dict with the timestamp, the strategy that found it,
+    decode stats and the milliseconds spent in each stage.
+
+    `scan` is the already opened Scan of the file and `known` holds crops read elsewhere
+    with the reader that read them (see ocr_batch); neither is needed for a plain call.
+    """
+    scan = scan or Scan(image_path)
+    timer, angle, image_hash = scan.timer, scan.angle, scan.image_hash
+    result = empty_result(layout=scan.layout, rows_total=scan.image.height)
+
+    # 1. The learned and default boxes, then the preprocessing ladder on the most likely box,
+    # which is far cheaper than the fallbacks
+    strategies, tight_boxes = scan.tight_strategies(initial_box)
+    name, _, best_box, _ = strategies[0]
+    strategies += [(name, angle, best_box, _preprocess[:rung]) for rung in range(1, len(_preprocess) + 1)]
+    found = process_image(lambda: scan.rows(max(box[3] for box in tight_boxes)), strategies, image_hash, timer,
+                          known=known)
+
+    larger_crop_box = (0, 0, scan.width, scan.height // 4)
+    if not settled(found):
+        # 2. Windows picked by the localizer in the top quarter, then the whole top quarter
+        # (racing strategies all share one decode, so the rotated ones need every row up front)
+        top = scan.rows(scan.image.height if _speculator else larger_crop_box[3])
+        box_size = (initial_box[2] - initial_box[0], initial_box[3] - initial_box[1])
+        with timer.stage('localize'):
+            windows = localize_boxes(crop(rotate(top, angle), larger_crop_box), box_size, exclude=tight_boxes)
+        fallbacks = [('localized box', angle, box, ()) for box in windows]
+        fallbacks.append(('larger box', angle, larger_crop_box, ()))
+
+        # 3. The opposite orientation, in case the detector was wrong
+        opposite = (angle + 180) % 360
+        rotated = [('rotated initial box', opposite, initial_box, ()),
+                   ('rotated larger box', opposite, larger_crop_box, ())]
+
+        if _speculator:
+            found = race_strategies(lambda: top, fallbacks + rotated, image_hash, timer, found)
+        else:
+            found = process_image(lambda: top, fallbacks, image_hash, timer, found)
+            if not settled(found):
+                found = process_image(lambda: scan.rows(scan.image.height), rotated, image_hash, timer, found)
+
+    result['rows_decoded'] = scan.image.rows_decoded
+    timestamp, strategy, confidence, reader = found
+    if strategy:
+        name, angle, box, stages = strategy
+        # Reads that stayed below the confidence threshold after every fallback go to a person
+        result.update(timestamp=timestamp, strategy=name, rotation=angle, box=list(box), preprocess=list(stages),
+                      confidence=confidence, review=not settled(found), reader=reader,
+                      profile=ink_profile(np.rot90(scan.thumbnail, angle // 90)).tolist())
+        learn_from_result(_layout_cache, result)
+        if angle and _save_rotated:
+            save_rotated_copy(image_path, scan.image.full(), angle)
+    result.update(ocr_calls=timer.calls['tesseract'], timings=timer.milliseconds())
+    return result
+
+def rescue_tiers(scan, initial_box):
+    """(tier, tesseract config, strategies) to escalate through on an image the usual strategies
+    could not read, cheapest first; a None config keeps the configured one."""
+    angle, width, height = scan.angle, scan.width, scan.height
+    opposite = (angle + 180) % 360
+    larger_crop_box = (0, 0, width, height // 4)
+    # A quarter turn swaps the sides of the upright image
+    turned_box = (0, 0, height, width // 4)
+    tiers = [
+        ('quarter turn', None, [(name, turn, box, ()) for turn in ((angle + 90) % 360, (angle + 270) % 360)
+                                for name, box in (('quarter-turned initial box', initial_box),
+                                                  ('quarter-turned larger box', turned_box))]),
+        ('wider box', None, [('top half', angle, (0, 0, width, height // 2), ()),
+                             ('rotated top half', opposite, (0, 0, width, height // 2), ()),
+                             ('whole image', angle, (0, 0, width, height), ())]),
+        # ocr_file() already climbed the ladder on the tightest box
+        ('preprocessing', None, [(f"preprocessed {name}", angle, box, _preprocess[:rung])
+                                 for name, box in (('larger box', larger_crop_box),
+                                                   ('top half', (0, 0, width, height // 2)))
+                                 for rung in range(1, len(_preprocess) + 1)]),
+    ]
+    config = get_backend().config
+    for psm in RESCUE_PSM:
+        if parse_tesseract_config(config)[0] == psm:
+            continue
+        strategies = [(f"psm {psm} initial box", angle, initial_box, ()),
+                      (f"psm {psm} larger box", angle, larger_crop_box, ())]
+        if _preprocess:
+            strategies.append((f"psm {psm} preprocessed initial box", angle, initial_box, _preprocess))
+        tiers.append((f"psm {psm}", with_psm(config, psm), strategies))
+    return [tier for tier in tiers if tier[2]]
+
+def rescue_file(image_path, initial_box=INITIAL_CROP_BOX):
+    """ocr_file() that keeps escalating through rescue_tiers() while the image stays unread.
+
+    Meant for the images a normal pass left as NF, so the costly tiers only run on the few
+    that need them. The result's 'tier' names the tier that read the timestamp ('standard'
+    for the usual strategies).
+    """
+    scan = Scan(image_path)
+    result = ocr_file(image_path, initial_box, scan=scan)
+    found = ("NF", None, None, None)
+    if result['strategy']:
+        result['tier'] = 'standard'
+        if not result['review']:
+            return result
+        found = (result['timestamp'], (result['strategy'], result['rotation'], tuple(result['box']),
+                                       tuple(result['preprocess'])), result['confidence'], result['reader'])
+
+    timer = scan.timer
+    image = scan.rows(scan.image.height)
+    tier = None
+    for name, config, strategies in rescue_tiers(scan, initial_box):
+        with tesseract_config(config):
+            read = process_image(lambda: image, strategies, scan.image_hash, timer, found)
+        if read[1] != found[1]:
+            tier = name
+        found = read
+        if settled(found):
+            break
+
+    if tier:
+        timestamp, (name, angle, box, stages), confidence, reader = found
+        # A quarter turn means the scan belongs to the layout of the turned size
+        size = (scan.image.width, scan.image.height) if angle in (0, 180) else (scan.image.height, scan.image.width)
+        result.update(timestamp=timestamp, strategy=name, rotation=angle, box=list(box), preprocess=list(stages),
+                      confidence=confidence, review=not settled(found), reader=reader, tier=tier,
+                      layout=layout_key(*size), profile=ink_profile(np.rot90(scan.thumbnail, angle // 90)).tolist())
+        learn_from_result(_layout_cache, result)
+        if angle and _save_rotated:
+            save_rotated_copy(image_path, scan.image.full(), angle)
+    result.update(rows_decoded=scan.image.rows_decoded, ocr_calls=timer.calls['tesseract'],
+                  timings=timer.milliseconds())
+    return result
+
+def ocr_batch(image_paths, initial_box=INITIAL_CROP_BOX, gap=24):
+    """OCR many files with one Tesseract call for all of their first crops.
+
+    The most likely crop of every image is tiled into a montage and read at once; words are
+    mapped back to their image by bounding box. Crops the glyph templates can read are left
+    out of the montage. Only images whose first read is not good enough go through the usual
+    per-crop strategies.
+    """
+    scans = []
+    crops = []
+    for image_path in image_paths:
+        if not os.path.exists(image_path):
+            scans.append(None)
+            continue
+        try:
+            scan = Scan(image_path)
+            strategy = scan.tight_strategies(initial_box)[0][0]
+            _, angle, box, _ = strategy
+            with scan.timer.stage('crop'):
+                cropped = crop(rotate(scan.rows(box[3]), angle), box)
+        except OSError as e:
+            # Truncated or garbage files (e.g. left behind by a killed download) stay NF
+            if not unreadable_image(e):
+                raise
+            print(f"Could not read {image_path}: {e}")
+            scans.append(None)
+            continue
+        with scan.timer.stage('templates'):
+            text = read_templates(cropped)
+        if text is not None:
+            timestamp, confidence = parse_ocr(text)
+            if not settled((timestamp, strategy, confidence, 'templates')):
+                text = None
+        if text is None:
+            crops.append(cropped)
+        scans.append((scan, strategy, text))
+
+    start = time.perf_counter()
+    cell_words = read_montage(crops, gap) if crops else []
+    share = (time.perf_counter() - start) / max(len(crops), 1)
+
+    results = []
+    words = iter(cell_words)
+    for item in scans:
+        if item is None:
+            results.append(empty_result())
+            continue
+        scan, strategy, text = item
+        reader = 'templates'
+        if text is None:
+            # The montage call is shared evenly among the images in it
+            scan.timer.seconds['montage'] += share
+            cell = next(words)
+            text = json.dumps(cell) if _min_confidence else ' '.join(word for word, _ in cell)
+            reader = 'montage'
+        try:
+            results.append(ocr_file(scan.path, initial_box, scan=scan, known={strategy[1:]: (text, reader)}))
+        except OSError as e:
+            # Only the top rows were decoded so far; the rest of the file may still be broken
+            if not unreadable_image(e):
+                raise
+            print(f"Could not read {scan.path}: {e}")
+            results.append(empty_result())
+    return results
+
+def read_montage(crops, gap=24):
+    """(word, confidence) pairs read from each crop, with one OCR call per montage of as many of them as fit."""
+    cell_words = []
+    config = get_backend().config
+    with tesseract_config(None if parse_tesseract_config(config)[0] == MONTAGE_PSM else with_psm(config, MONTAGE_PSM)):
+        for group in pack_montages([to_gray(cropped) if cropped.size else cropped for cropped in crops], gap):
+            montage, cells = build_montage(group, gap)
+            cell_words.extend(assign_words(get_backend().image_to_word_boxes(montage), cells))
+    return cell_words
@@ -0,0 +1,133 @@
+import argparse
+import csv
+import json
+import os
+from collections import Counter
+
+from timestamp_ocr import extract_filename
+
+# Sorts the rows without a timestamp by why they failed, in one pass over the results CSV.
+# The images of every reason are linked (not copied) into a folder of their own, so
+# they can be browsed or fed back to validate-ocr.py without duplicating any bytes.
+
+# Failure reasons besides "download-<error class>"; their folders are rebuilt on every run
+REASONS = ('missing', 'empty', 'not-ocred', 'no-timestamp', 'low-confidence')
+
+def read_ledger(path):
+    """URL -> error class of the last failed download of each URL in get-images.py's ledger."""
+    errors = {}
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as ledger_file:
+            for line in ledger_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    errors[entry['url']] = entry['error_class']
+    return errors
+
+def read_ocred(path):
+    """URLs that ocr-time.py or download-and-ocr.py has OCR'ed, according to their metrics sidecar file."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as metrics_file:
+        return {json.loads(line)['URL'] for line in metrics_file if line.strip()}
+
+def failure_reason(row, size, download_errors, ocred, min_confidence):
+    """Why a row has no trusted timestamp, or None if it has one."""
+    if row['timestamp'] != "NF":
+        confidence = row.get('confidence')
+        if min_confidence and confidence and float(confidence) < min_confidence:
+            return 'low-confidence'
+        return None
+    if size is None:
+        error_class = download_errors.get(row['URL'])
+        return f"download-{error_class}" if error_class else 'missing'
+    if size == 0:
+        return 'empty'
+    if ocred is not None and row['URL'] not in ocred:
+        return 'not-ocred'
+    return 'no-timestamp'
+
+def link(src, dst, symbolic=False):
+    """Hard-link `src` to `dst`, or symlink it when asked or when hard links are not possible."""
+    if not symbolic:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass  # Another filesystem, or one without hard links
+    os.symlink(os.path.abspath(src), dst)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the NF rows by failure reason and link their images.")
+    parser.add_argument('--csv', default="data/resultados-with-timestamps.csv", help="Results CSV from ocr-time.py")
+    parser.add_argument('--image-dir', default="downloaded_images")
+    parser.add_argument('--output-dir', default="nf_images",
+                        help="Folder that gets one subfolder of linked images per failure reason")
+    parser.add_argument('--urls', default="urls_with_nf.csv", help="CSV file that receives every URL and its reason")
+    parser.add_argument('--ledger', default="failed_downloads.jsonl",
+                        help="Failure ledger of get-images.py, to tell why an image is missing")
+    parser.add_argument('--metrics', default="ocr-metrics.jsonl",
+                        help="Metrics sidecar of ocr-time.py and download-and-ocr.py, to tell images never OCR'ed "
+                             "from unreadable ones")
+    parser.add_argument('--min-confidence', type=float, default=0,
+                        help="Also triage timestamps whose confidence column is below this (0 = only NF)")
+    parser.add_argument('--symlink', action='store_true', help="Use symbolic links instead of hard links")
+    args = parser.parse_args()
+
+    download_errors = read_ledger(args.ledger)
+    ocred = read_ocred(args.metrics)
+    reasons = Counter()
+    views = {}
+    # download-and-ocr.py appends a row every time it reads a URL again; like ocr-time.py,
+    # keep the best row per URL, where a timestamp wins over NF
+    rows = {}
+    with open(args.csv, 'r', newline='', encoding='utf-8') as infile:
+        for row in csv.DictReader(infile):
+            if row['URL'] not in rows or row['timestamp'] != "NF":
+                rows[row['URL']] = row
+
+    with open(args.urls, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['URL', 'reason'])
+        for row in rows.values():
+            filename = extract_filename(row['URL'])
+            src = os.path.join(args.image_dir, filename)
+            try:
+                size = os.stat(src).st_size
+            except FileNotFoundError:
+                size = None
+            reason = failure_reason(row, size, download_errors, ocred, args.min_confidence)
+            if reason is None:
+                continue
+            reasons[reason] += 1
+            writer.writerow([row['URL'], reason])
+            if size is not None:
+                views.setdefault(reason, {})[filename] = src
+
+    # Links left over from an earlier triage are removed, so each folder only holds current failures
+    linked = 0
+    os.makedirs(args.output_dir, exist_ok=True)
+    earlier = {entry.name for entry in os.scandir(args.output_dir)
+               if entry.is_dir() and (entry.name in REASONS or entry.name.startswith('download-'))}
+    for reason in sorted(set(views) | earlier):
+        view_dir = os.path.join(args.output_dir, reason)
+        os.makedirs(view_dir, exist_ok=True)
+        wanted = views.get(reason, {})
+        for entry in os.scandir(view_dir):
+            if entry.name not in wanted:
+                os.remove(entry.path)
+        for filename, src in wanted.items():
+            dst = os.path.join(view_dir, filename)
+            if os.path.lexists(dst):
+                # A download that replaced the image leaves a hard link to the old file behind
+                if os.path.exists(dst) and os.path.samefile(src, dst):
+                    continue
+                os.remove(dst)
+            link(src, dst, args.symlink)
+            linked += 1
+
+    total = sum(reasons.values())
+    print(f"{total} rows without a trusted timestamp, {linked} new links in {args.output_dir}")
+    for reason, count in reasons.most_common():
+        print(f"  {reason:<20} {count:>7} {count / total:>6.1%}")
+    print(f"URLs and reasons written to {args.urls}")
@@ -8,6 +8,8 @@ from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHB
 from PyQt5.QtGui import QPixmap, QPainter, QColor, QImage
 from PyQt5.QtCore import Qt, QRectF, QPointF, QRect, QPoint, QSize
 
+from ocr_cache import OcrCache, cache_key, hash_image
+
 # Set the path to the Tesseract executable
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'  # Update this path if necessary
 
@@ -120,6 +122,11 @@ class MainWindow(QMainWindow):
         self.csv_data = []
         self.current_row = 0
         self.image_dir = ""
+        self.image_hash = None
+
+        # Same cache file as ocr-time.py, but a hand-drawn selection never matches the key of a
+        # batch crop, so only selections this tool already read come back instantly
+        self.ocr_cache = OcrCache("ocr_cache.sqlite")
 
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
@@ -197,6 +204,9 @@ class MainWindow(QMainWindow):
         if cv_img is None:
             print(f"Failed to load image: {image_path}")
             return
+
+        with open(image_path, 'rb') as image_file:
+            self.image_hash = hash_image(image_file.read())
         
         # Get image dimensions
         height, width, channel = cv_img.shape
@@ -216,6 +226,11 @@ class MainWindow(QMainWindow):
         else:
             self.image_viewer.setImage(pixmap)
 
+    def closeEvent(self, event):
+        # Hits are written in batches; flush them and enforce the size bound before quitting
+        self.ocr_cache.close()
+        super().closeEvent(event)
+
     def update_timestamp(self):
         new_timestamp = self.timestamp_edit.text()
         timestamp_column = self.csv_data[0].index("timestamp")
@@ -243,8 +258,13 @@ class MainWindow(QMainWindow):
             # Crop the image
             cropped = gray[selected_region.top():selected_region.bottom(), selected_region.left():selected_region.right()]
             
-            # Perform OCR
-            text = pytesseract.image_to_string(cropped, config='--psm 6')
+            # Perform OCR, unless this crop was read before
+            box = (selected_region.left(), selected_region.top(), selected_region.right(), selected_region.bottom())
+            key = cache_key(self.image_hash, box, self.image_viewer.rotation, ('rgba2gray',), 'pytesseract --psm 6')
+            text = self.ocr_cache.get(key)
+            if text is None:
+                text = pytesseract.image_to_string(cropped, config='--psm 6')
+                self.ocr_cache.put(key, text)
             
             # Update the timestamp field
             self.timestamp_edit.setText(text.strip())
@@ -0,0 +1,132 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+
+class WorkQueue:
+    """Image URLs to OCR, shared by several ocr-time.py nodes through one SQLite file.
+
+    Nodes lease batches of URLs, renew the lease while they work and commit all the
+    results of a batch in one transaction. A lease that is not renewed within
+    `lease_seconds` (the node died or hung) expires and its URLs go to the next node
+    that asks for work, so no image is lost and none is committed twice.
+
+    Expired URLs are leased again in ever smaller batches (half as many on every attempt),
+    so an image that keeps crashing its node ends up alone in a lease and only that image
+    runs out of `max_attempts`.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=10):
+        # Shared filesystems rarely support WAL's shared memory, so the default rollback
+        # journal is kept; the file lock serializes the nodes
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('CREATE TABLE IF NOT EXISTS work (url TEXT PRIMARY KEY, state TEXT, lease TEXT, '
+                        'worker TEXT, expires REAL, attempts INTEGER DEFAULT 0, result TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS work_state ON work (state, expires)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS work_lease ON work (lease)')
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two nodes never lease the same rows
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def add(self, urls):
+        """Queue the URLs that are not queued yet; returns how many were added."""
+        with self.transaction():
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO work (url, state) VALUES (?, 'pending')",
+                                ((url,) for url in urls))
+            return self.db.total_changes - before
+
+    def lease(self, worker, count):
+        """Lease id and up to `count` URLs that are pending, or else URLs whose lease expired."""
+        lease_id = uuid.uuid4().hex
+        # Expiry uses wall-clock time, so lease_seconds must be well above the clock skew between nodes
+        now = time.time()
+        with self.transaction():
+            urls = [url for url, in self.db.execute("SELECT url FROM work WHERE state = 'pending' LIMIT ?", (count,))]
+            if not urls:
+                attempts, = self.db.execute("SELECT MIN(attempts) FROM work WHERE state = 'leased' AND expires < ? "
+                                            "AND attempts < ?", (now, self.max_attempts)).fetchone()
+                if attempts is not None:
+                    # Halving the batch on every attempt isolates the image that made the lease expire
+                    urls = [url for url, in self.db.execute(
+                        "SELECT url FROM work WHERE state = 'leased' AND expires < ? AND attempts = ? "
+                        "ORDER BY lease LIMIT ?", (now, attempts, max(1, count >> attempts)))]
+            self.db.executemany("UPDATE work SET state = 'leased', lease = ?, worker = ?, expires = ?, "
+                                "attempts = attempts + 1 WHERE url = ?",
+                                ((lease_id, worker, now + self.lease_seconds, url) for url in urls))
+        return lease_id, urls
+
+    def heartbeat(self, lease_id):
+        """Extend a lease; False if it already went to another node."""
+        with self.transaction():
+            cursor = self.db.execute("UPDATE work SET expires = ? WHERE lease = ? AND state = 'leased'",
+                                     (time.time() + self.lease_seconds, lease_id))
+        return cursor.rowcount > 0
+
+    @contextmanager
+    def keep_alive(self, lease_id):
+        """Renew the lease from a background thread while the body runs."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                self.heartbeat(lease_id)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, lease_id, results):
+        """Store the results (URL -> JSON-serializable entry) of a whole lease at once.
+
+        Nothing is stored and False is returned if any of its URLs was leased again by
+        another node in the meantime; that node's results will be committed instead.
+        """
+        with self.transaction():
+            held = self.db.execute("SELECT COUNT(*) FROM work WHERE lease = ? AND state = 'leased'",
+                                   (lease_id,)).fetchone()[0]
+            if held != len(results):
+                return False
+            self.db.executemany("UPDATE work SET state = 'done', result = ?, expires = NULL "
+                                "WHERE url = ? AND lease = ?",
+                                ((json.dumps(entry), url, lease_id) for url, entry in results.items()))
+        return True
+
+    def counts(self):
+        """Number of URLs per state; expired leases out of attempts are counted as 'failed'."""
+        counts = Counter()
+        with self.lock:
+            for state, failed, count in self.db.execute(
+                    "SELECT state, state = 'leased' AND attempts >= ? AND expires < ?, COUNT(*) "
+                    "FROM work GROUP BY 1, 2", (self.max_attempts, time.time())):
+                counts['failed' if failed else state] += count
+        return counts
+
+    def results(self):
+        """URL -> entry of every committed result."""
+        with self.lock:
+            rows = self.db.execute("SELECT url, result FROM work WHERE state = 'done'").fetchall()
+        return {url: json.loads(result) for url, result in rows}
+
+    def close(self):
+        self.db.close()